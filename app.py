@@ -23,7 +23,7 @@ from pipeline.runner import run_pipeline
 from pipeline import Fascia_Gemini, Reveal_Gemini
 from pipeline.excel_exporter import create_excel_from_result
 from auth import get_current_user
-from s3_utils import upload_pipeline_outputs, get_s3_client
+from s3_utils import submit_pipeline_outputs, collect_pipeline_outputs, get_s3_client
 
 # ... (omitted sections)
 # -----------------------------
@@ -559,6 +559,19 @@ def run_and_store(run_id: str, pdf_path: str):
         result["fascia_extraction"] = fascia_result
         result["reveal_extraction"] = reveal_result
 
+        # The original PDF and the per-page debug PDFs are final once all three
+        # pipelines have returned, so start uploading them now; they overlap
+        # with the Excel/JSON/log work below and are collected with the rest.
+        early_files = {"pdf_original": pdf_path}  # Upload original PDF so it can be viewed later
+        early_debug_dir = result.get("debug_pdf")
+        if early_debug_dir and os.path.isdir(early_debug_dir):
+            for pdf_name in os.listdir(early_debug_dir):
+                if pdf_name.endswith(".pdf"):
+                    # Key format: "debug_pdf/<filename>" so S3 key becomes
+                    # pipeline-outputs/<run_id>/pdf/<filename>
+                    early_files[f"debug_pdf/{pdf_name}"] = os.path.join(early_debug_dir, pdf_name)
+        early_uploads = submit_pipeline_outputs(run_id, early_files)
+
 
 
         # ------------------
@@ -719,28 +732,22 @@ def run_and_store(run_id: str, pdf_path: str):
         # ------------------
         # Upload to S3 (non-blocking for pipeline completion)
         # ------------------
+        # Original + debug PDFs are already uploading (early_uploads)
         files_to_upload = {
             "excel": excel_path,
             "json": json_path,
-            "pdf_original": pdf_path,  # Upload original PDF so it can be viewed later
         }
         
         # Add optional files if they exist
         if result.get("log_file"):
             files_to_upload["log_file"] = result.get("log_file")
-            
-        # Add all individual debug PDFs from the pdf directory
-        if debug_pdf_dir and os.path.isdir(debug_pdf_dir):
-            for pdf_name in debug_pdf_pages:
-                pdf_full_path = os.path.join(debug_pdf_dir, pdf_name)
-                if os.path.exists(pdf_full_path):
-                    # Key format: "debug_pdf/<filename>" so S3 key becomes
-                    # pipeline-outputs/<run_id>/pdf/<filename>
-                    files_to_upload[f"debug_pdf/{pdf_name}"] = pdf_full_path
 
         # Upload all files to S3 in parallel
         try:
-            s3_data = upload_pipeline_outputs(run_id, files_to_upload, cleanup_local=False)
+            s3_data = collect_pipeline_outputs(
+                {**early_uploads, **submit_pipeline_outputs(run_id, files_to_upload)},
+                cleanup_local=False,
+            )
 
             # Build debug_pdf_pages with S3 URLs for frontend access
             debug_pdf_pages_s3 = []
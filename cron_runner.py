@@ -24,23 +24,28 @@ def stringify_keys(obj):
 
 
 # -----------------------------
-# Load ENV
+# Mongo Setup (MongoDB Atlas via .env)
 # -----------------------------
-load_dotenv()
+# Connected on first use, not at import: the page pools spawn workers that
+# re-import this script as __mp_main__, and each would otherwise load .env
+# and open its own MongoClient (same reason as pipeline/runner.py).
+_runs_collection = None
 
 
-# -----------------------------
-# Mongo Setup (MongoDB Atlas via .env)
-# -----------------------------
-MONGO_URL = os.getenv("MONGO_URL")
+def get_runs_collection():
+    global _runs_collection
+    if _runs_collection is None:
+        load_dotenv()
+        MONGO_URL = os.getenv("MONGO_URL")
 
-if not MONGO_URL:
-    raise RuntimeError("MONGO_URL not set in .env file")
+        if not MONGO_URL:
+            raise RuntimeError("MONGO_URL not set in .env file")
 
-client = MongoClient(MONGO_URL)
+        client = MongoClient(MONGO_URL)
 
-db = client["simpson_pipeline"]
-runs_collection = db["runs"]
+        db = client["simpson_pipeline"]
+        _runs_collection = db["runs"]
+    return _runs_collection
 
 
 # -----------------------------
@@ -62,6 +67,8 @@ os.makedirs(ERROR_DIR, exist_ok=True)
 # -----------------------------
 def run_batch():
 
+    runs_collection = get_runs_collection()
+
     pdfs = glob.glob(os.path.join(INPUT_DIR, "*.pdf"))
 
     print(f"[CRON] Found {len(pdfs)} PDFs")
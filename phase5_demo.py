@@ -174,25 +174,25 @@ def get_vector_mask_area(page, crop_rect, px_per_ft_base):
     # Smart Filter
     img_h, img_w = gray.shape
     total_area = img_h * img_w
-    valid_contours = []
+    min_area, max_area = total_area * 0.005, total_area * 0.95
+    valid_contours = []  # (area, contour): area computed once, reused for the max
     
     for cnt in contours:
         area_px = cv2.contourArea(cnt)
-        if area_px < (total_area * 0.005): continue # Too small (noise)
-        if area_px > (total_area * 0.95): continue # Too big (border)
+        if area_px < min_area: continue # Too small (noise)
+        if area_px > max_area: continue # Too big (border)
         
         _, _, cw, ch = cv2.boundingRect(cnt)
         if ch > 0:
             aspect = cw/ch
             if aspect > 40 or aspect < 0.02: continue # Lines
             
-        valid_contours.append(cnt)
+        valid_contours.append((area_px, cnt))
     
     if not valid_contours: return 0.0, Image.fromarray(gray)
 
     # Pick largest valid shape
-    target_cnt = max(valid_contours, key=cv2.contourArea)
-    area_px_zoom = cv2.contourArea(target_cnt)
+    area_px_zoom, target_cnt = max(valid_contours, key=lambda t: t[0])
     
     # Calculate Square Footage
     # Real Scale = Base Scale * Zoom Factor
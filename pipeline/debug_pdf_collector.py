@@ -228,10 +228,8 @@ def collect_and_write_debug_pdf(
                     if conf is None:
                         conf = global_confidence
 
-                    # Prepare image copy
-                    if img.mode != "RGB":
-                        img = img.convert("RGB")
-                    img_copy = img.copy()
+                    # Prepare image copy (convert already returns a new image)
+                    img_copy = img.convert("RGB") if img.mode != "RGB" else img.copy()
 
                     _draw_confidence_overlay(img_copy, conf, clean_label)
 
@@ -314,9 +312,7 @@ def _save_annotated_entries(
             sub_letter = chr(ord("a") + sub_idx)
 
             with Image.open(img_path) as ann_img:
-                if ann_img.mode != "RGB":
-                    ann_img = ann_img.convert("RGB")
-                ann_copy = ann_img.copy()
+                ann_copy = ann_img.convert("RGB") if ann_img.mode != "RGB" else ann_img.copy()
 
             filename = "{0}_page_{1}{2}.pdf".format(source, human_page, sub_letter)
             filepath = os.path.join(pdf_dir, filename)
@@ -42,13 +42,20 @@ def create_excel_from_result(result: dict, output_path: str):
     project_specs = result.get("project_specs", {})
 
     # -------------------------------
-    # Calculate Total Deductions
+    # Partition line items (single pass) + Total Deductions
     # -------------------------------
-    total_deductions = sum(
-        item.get("Total_SF", 0)
-        for item in line_items
-        if str(item.get("Category", "")).strip().lower() == "deduction"
-    )
+    deduction_items = []
+    eifs_items = []
+    ded_total_sfs = []
+    for item in line_items:
+        category = str(item.get("Category", "")).strip()
+        if category.lower() == "deduction":
+            deduction_items.append(item)
+            ded_total_sfs.append(float(item.get("Total_SF") or 0))
+        if "EIFS" in category.upper():
+            eifs_items.append(item)
+
+    total_deductions = sum(ded_total_sfs)
 
     # ===============================
     # SUMMARY SHEET
@@ -76,17 +83,16 @@ def create_excel_from_result(result: dict, output_path: str):
         "Total_SF",
     ])
 
-    for item in line_items:
-        if str(item.get("Category", "")).strip().lower() == "deduction":
-            ws_ded.append([
-                item.get("Page"),
-                item.get("View"),
-                item.get("Description"),
-                item.get("Dimensions", ""),
-                item.get("Count"),
-                item.get("Unit_SF"),
-                item.get("Total_SF"),
-            ])
+    for item in deduction_items:
+        ws_ded.append([
+            item.get("Page"),
+            item.get("View"),
+            item.get("Description"),
+            item.get("Dimensions", ""),
+            item.get("Count"),
+            item.get("Unit_SF"),
+            item.get("Total_SF"),
+        ])
 
 
     # -------------------------------
@@ -94,12 +100,19 @@ def create_excel_from_result(result: dict, output_path: str):
     # -------------------------------
     # Create a set of processed items (Page, View, clean_tag) to avoid duplicates
     processed_keys = set()
-    for item in line_items:
-        if str(item.get("Category", "")).strip().lower() == "deduction":
-            # Extract tag from description "Opening TYPE A" -> "TYPE A"
-            desc = item.get("Description", "")
-            # Simple heuristic: assume description ends with the tag or contains it
-            processed_keys.add(f"{item.get('Page')}_{item.get('View')}_{desc}")
+    for item in deduction_items:
+        # Extract tag from description "Opening TYPE A" -> "TYPE A"
+        desc = item.get("Description", "")
+        # Simple heuristic: assume description ends with the tag or contains it
+        processed_keys.add(f"{item.get('Page')}_{item.get('View')}_{desc}")
+
+    # Flatten library (lite version of phase5 logic)
+    all_types = {}
+    all_types.update(project_specs.get('windows', {}))
+    all_types.update(project_specs.get('doors', {}))
+    # Fuzzy match ignores dashes on either side ("W-1" <-> "W1")
+    all_type_keys = set(all_types)
+    all_type_keys_nodash = {k.replace("-", "") for k in all_type_keys}
 
     for page_num, views in survey_data.items():
         for view_label, tags in views.items():
@@ -114,19 +127,11 @@ def create_excel_from_result(result: dict, output_path: str):
                   # Actually, easier: check if this tag exists in the specs. 
                   # If NOT, it's definitely missing.
                   
-                  # Flatten library (lite version of phase5 logic)
-                  all_types = {}
-                  all_types.update(project_specs.get('windows', {}))
-                  all_types.update(project_specs.get('doors', {}))
-                  
-                  spec_found = False
-                  if clean_tag in all_types:
-                      spec_found = True
-                  else:
-                      for key in all_types:
-                          if clean_tag == key.replace("-", "") or key == clean_tag.replace("-", ""):
-                              spec_found = True
-                              break
+                  spec_found = (
+                      clean_tag in all_type_keys
+                      or clean_tag in all_type_keys_nodash
+                      or clean_tag.replace("-", "") in all_type_keys
+                  )
                   
                   if not spec_found:
                       ws_ded.append([
@@ -153,19 +158,16 @@ def create_excel_from_result(result: dict, output_path: str):
         "Total_SF",
     ])
 
-    for item in line_items:
-        category = item.get("Category", "")
-
-        if "EIFS" in category.upper():
-            ws_eifs.append([
-                item.get("Page"),
-                item.get("View"),
-                item.get("Description"),
-                item.get("Dimensions", ""),
-                item.get("Count"),
-                item.get("Unit_SF"),
-                item.get("Total_SF"),
-            ])
+    for item in eifs_items:
+        ws_eifs.append([
+            item.get("Page"),
+            item.get("View"),
+            item.get("Description"),
+            item.get("Dimensions", ""),
+            item.get("Count"),
+            item.get("Unit_SF"),
+            item.get("Total_SF"),
+        ])
 
     # ── Fascia & Reveal extractions ──────────────────────────────────────────
     for extraction_key, label in [("fascia_extraction", "Fascia"), ("reveal_extraction", "Reveal")]:
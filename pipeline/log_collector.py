@@ -6,6 +6,11 @@ import sys
 from datetime import datetime
 from contextlib import contextmanager
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 
 class CaptureOutput(object):
     """Simple output capture that works"""
@@ -133,14 +138,15 @@ class LogCollector(object):
             sys.stdout = self._original_stdout
             captured = self._captured_output.getvalue()
             
-            # Parse captured output into log entries
+            # Parse captured output into log entries. Every line is stamped
+            # at capture end anyway, so format the timestamp once.
             if captured:
-                for line in captured.strip().split('\n'):
-                    if line.strip():
-                        self.logs[phase_name].append({
-                            "timestamp": datetime.utcnow().isoformat(),
-                            "message": line.strip()
-                        })
+                timestamp = datetime.utcnow().isoformat()
+                self.logs[phase_name].extend(
+                    {"timestamp": timestamp, "message": line}
+                    for line in map(str.strip, captured.splitlines())
+                    if line
+                )
             
             # Also print to console
             if captured:
@@ -276,7 +282,13 @@ class LogCollector(object):
                     p3_match = re.search(r"- (.*?):\s*Found\s*({.*})", msg)
                     if p3_match:
                         try:
-                            counts = ast.literal_eval(p3_match.group(2))
+                            # Counts are printed as a Python dict repr; json.loads
+                            # handles the common case far faster than literal_eval.
+                            raw = p3_match.group(2)
+                            try:
+                                counts = json.loads(raw.replace("'", '"'))
+                            except ValueError:
+                                counts = ast.literal_eval(raw)
                             pages[current_page][phase].append({
                                 "view": p3_match.group(1),
                                 "counts": counts,
@@ -367,8 +379,13 @@ class LogCollector(object):
             "pages": page_logs,
         }
         
-        with open(log_path, 'w') as f:
-            json.dump(log_data, f, indent=2)
+        if orjson is not None:
+            with open(log_path, 'wb') as f:
+                f.write(orjson.dumps(log_data, default=str,
+                                     option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS))
+        else:
+            with open(log_path, 'w') as f:
+                json.dump(log_data, f, indent=2)
         
         return log_path
     
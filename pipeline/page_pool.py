@@ -0,0 +1,114 @@
+import io
+import sys
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, wait
+from contextlib import redirect_stdout
+
+
+# ============================================================
+# PAGE POOL — SHARED BY PHASES 3, 4 AND 5
+# ============================================================
+# - Spawned workers (not forked: the caller runs other pipelines on
+#   threads and may hold a CUDA context, neither survives a fork)
+# - Items are dealt into cost-balanced batches, one per worker
+# - A failed batch (BrokenProcessPool, pickling error) becomes error
+#   entries for its items instead of failing the run
+# - should_stop() is polled in the parent; workers see it through
+#   stop_requested() and skip their remaining items
+# - Workers run OpenCV on the CPU (one CUDA context per process would
+#   multiply GPU memory)
+# ============================================================
+
+logger = logging.getLogger(__name__)
+
+CANCEL_POLL_SECONDS = 1.0
+
+# Set in each worker from the parent's stop flag
+_worker_stop = None
+
+
+def _init_worker(stop):
+    global _worker_stop
+    _worker_stop = stop
+    import pipeline
+    pipeline.USE_CUDA = False  # seen by phase modules imported after this
+    for name, module in list(sys.modules.items()):
+        # ...and by those already imported with the script (e.g. cron_runner)
+        if name.startswith("pipeline.") and hasattr(module, "USE_CUDA"):
+            module.USE_CUDA = False
+
+
+def stop_requested():
+    """True inside a worker once the parent has asked the pool to stop."""
+    return _worker_stop is not None and _worker_stop.is_set()
+
+
+def balance_chunks(costs, n):
+    """
+    Splits job indices into n worker batches, largest job first onto the
+    least-loaded batch (LPT), so one foldout does not straggle at the end.
+    Equal costs give the same round-robin batches as a strided split.
+    """
+    loads = [0.0] * n
+    chunks = [[] for _ in range(n)]
+    for i in sorted(range(len(costs)), key=lambda i: -costs[i]):
+        w = loads.index(min(loads))
+        chunks[w].append(i)
+        loads[w] += costs[i]
+    return chunks
+
+
+def call_captured(fn, *args):
+    """
+    Calls fn(*args), whose result ends in a list of log lines starting with
+    the page header, and splices anything printed meanwhile in after that
+    header. Worker stdout never reaches the parent's LogCollector, and
+    in-process prints would land before the header (printed at merge time).
+    """
+    buf = io.StringIO()
+    with redirect_stdout(buf):
+        out = fn(*args)
+    out[-1][1:1] = buf.getvalue().splitlines()
+    return out
+
+
+def run_page_batches(batch_fn, pdf_path, items, costs, num_workers, error_entry,
+                     args=(), should_stop=None):
+    """
+    Runs batch_fn(pdf_path, batch, *args) over cost-balanced batches of items
+    in spawned workers. batch_fn returns one output per item of its batch.
+    Returns the outputs in item order; items whose batch failed (or never
+    ran) get error_entry(item, error).
+    """
+    num_workers = max(1, min(num_workers, len(items)))
+    index_chunks = balance_chunks(costs or [1.0] * len(items), num_workers)
+    ctx = multiprocessing.get_context("spawn")
+    by_index = {}
+    try:
+        stop = ctx.Event()
+        with ProcessPoolExecutor(max_workers=num_workers, mp_context=ctx,
+                                 initializer=_init_worker, initargs=(stop,)) as executor:
+            future_to_idx = {
+                executor.submit(batch_fn, pdf_path, [items[i] for i in idx], *args): idx
+                for idx in index_chunks
+            }
+            pending = set(future_to_idx)
+            while pending:
+                done, pending = wait(pending, timeout=CANCEL_POLL_SECONDS)
+                if should_stop is not None and should_stop():
+                    stop.set()
+                for future in done:
+                    idx = future_to_idx[future]
+                    try:
+                        outputs = future.result()
+                    except Exception as e:
+                        outputs = [error_entry(items[i], f"worker failed: {e}") for i in idx]
+                    for i, out in zip(idx, outputs):
+                        by_index[i] = out
+    except Exception as e:
+        # logged, not printed: Phase 4 runs this off the main thread while
+        # another phase holds the stdout capture
+        logger.error(f"Page pool error: {e}")
+    return [by_index[i] if i in by_index else error_entry(item, "worker failed")
+            for i, item in enumerate(items)]
@@ -1,10 +1,19 @@
 import fitz  # PyMuPDF
 import ollama
-import io
+import os
 import re
 import json
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from PIL import Image, ImageDraw
+from pipeline.vlm_image import encode_vlm_jpeg, VLM_JPEG_QUALITY
+
+try:
+    from pipeline.phase3_v4 import get_page_image
+except ImportError:
+    def get_page_image(doc, page_num, zoom=1.0):
+        pix = doc[page_num - 1].get_pixmap(matrix=fitz.Matrix(zoom, zoom), alpha=False)
+        return Image.frombytes("RGB", (pix.width, pix.height), pix.samples)
 
 # --- LOGGING ---
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -12,14 +21,24 @@ logger = logging.getLogger(__name__)
 
 MODEL_NAME = "qwen3-vl:30b-a3b-instruct"
 
+_M_VLM = fitz.Matrix(0.5, 0.5)
+
+# Concurrent VLM fallback requests. Ollama only serves OLLAMA_NUM_PARALLEL
+# requests at once and queues the rest, so keep this at or below that setting.
+VLM_WORKERS = min(8, (os.cpu_count() or 1) * 2)
+
 # ==========================================
 # 1. VISUAL DEBUGGER
 # ==========================================
 def generate_debug_thumbnail(page, category, reason):
     try:
         # Increased resolution from 0.3 to 1.5 for better quality
-        pix = page.get_pixmap(matrix=fitz.Matrix(1.5, 1.5)) 
-        img = Image.open(io.BytesIO(pix.tobytes("png")))
+        if category == "Exterior_Elevation":
+            # Phase 3 draws its debug sheet on the same 1.5x render; cache it
+            img = get_page_image(page.parent, page.number + 1, 1.5).copy()
+        else:
+            pix = page.get_pixmap(matrix=fitz.Matrix(1.5, 1.5)) 
+            img = Image.frombytes("RGB", (pix.width, pix.height), pix.samples)
         draw = ImageDraw.Draw(img)
         
         is_actionable = category in ["Exterior_Elevation", "Schedule", "Type_Definition", "Floor_Plan"]
@@ -48,7 +67,8 @@ def get_page_stats(page):
     except Exception:
         pass
         
-    page_area = page.rect.width * page.rect.height
+    r = page.rect
+    page_area = r.width * r.height
     raster_pct = (img_area / page_area) * 100 if page_area > 0 else 0
     
     # Vector Count (Line Drawings have high count)
@@ -59,7 +79,8 @@ def get_page_stats(page):
 def analyze_title_block(page):
     # Scan bottom right 15% of page for Sheet ID / Title
     r = page.rect
-    clip = fitz.Rect(r.width*0.6, r.height*0.85, r.width, r.height)
+    w, h = r.width, r.height
+    clip = fitz.Rect(w*0.6, h*0.85, w, h)
     text = page.get_text("text", clip=clip).upper()
     return text
 
@@ -107,9 +128,9 @@ def classify_by_rules(text, stats):
 # 4. VLM CLASSIFIER (Fallback)
 # ==========================================
 def classify_by_vlm(page_image):
-    byte_arr = io.BytesIO()
-    page_image.save(byte_arr, format='PNG')
-    
+    return classify_by_vlm_bytes(encode_vlm_jpeg(page_image))
+
+def classify_by_vlm_bytes(img_bytes):
     prompt = """
     Classify this architectural sheet.
     OPTIONS:
@@ -122,7 +143,7 @@ def classify_by_vlm(page_image):
     OUTPUT JSON: {"class": "Category", "reason": "..."}
     """
     try:
-        response = ollama.chat(model=MODEL_NAME, messages=[{'role': 'user', 'content': prompt, 'images': [byte_arr.getvalue()]}])
+        response = ollama.chat(model=MODEL_NAME, messages=[{'role': 'user', 'content': prompt, 'images': [img_bytes]}])
         match = re.search(r"\{.*\}", response['message']['content'], re.DOTALL)
         if match: return json.loads(match.group(0))
     except: pass
@@ -131,13 +152,17 @@ def classify_by_vlm(page_image):
 # ==========================================
 # 5. EXECUTE
 # ==========================================
-def execute(pdf_path, max_pages=50):
+def execute(pdf_path, max_pages=50, doc=None, thumbnails=True):
     print("--- [Phase 1] Strict Classification ---")
-    doc = fitz.open(pdf_path)
+    if doc is None: doc = fitz.open(pdf_path)
     results = []
     
     scan_limit = len(doc)
     
+    # Pass 1: rule check. PyMuPDF is not thread-safe, so every page
+    # access stays on this thread.
+    classified = []   # [stats, cat, reason] per page
+    pending_vlm = {}  # page index -> encoded page image for the VLM
     for i in range(scan_limit):
         page = doc[i]
         # Call Safe Stats
@@ -146,22 +171,32 @@ def execute(pdf_path, max_pages=50):
         
         # Rule Check
         cat, reason = classify_by_rules(tb_text, stats)
-        
-        # VLM Fallback
         if not cat:
-            pix = page.get_pixmap(matrix=fitz.Matrix(0.5, 0.5))
-            img = Image.open(io.BytesIO(pix.tobytes("png")))
-            vlm_res = classify_by_vlm(img)
-            cat = vlm_res.get("class", "Irrelevant")
-            reason = vlm_res.get("reason", "VLM")
-            
-            # Double check VLM result against Raster Guard
-            if cat == "Exterior_Elevation" and stats['raster'] > 40.0:
-                cat = "Irrelevant"
-                reason = "VLM Overridden by Raster Guard"
-
+            pending_vlm[i] = page.get_pixmap(matrix=_M_VLM).tobytes("jpg", jpg_quality=VLM_JPEG_QUALITY)
+        
+        classified.append([stats, cat, reason])
+    
+    # Pass 2: VLM Fallback — the calls are pure network wait, so overlap them
+    if pending_vlm:
+        with ThreadPoolExecutor(max_workers=min(VLM_WORKERS, len(pending_vlm))) as executor:
+            vlm_results = executor.map(classify_by_vlm_bytes, pending_vlm.values())
+            for i, vlm_res in zip(pending_vlm, vlm_results):
+                stats = classified[i][0]
+                cat = vlm_res.get("class", "Irrelevant")
+                reason = vlm_res.get("reason", "VLM")
+                
+                # Double check VLM result against Raster Guard
+                if cat == "Exterior_Elevation" and stats['raster'] > 40.0:
+                    cat = "Irrelevant"
+                    reason = "VLM Overridden by Raster Guard"
+                
+                classified[i][1:] = [cat, reason]
+    
+    # Pass 3: report in page order
+    for i, (_, cat, reason) in enumerate(classified):
         print(f"  P{i+1}: [{cat}] ({reason})")
-        thumb = generate_debug_thumbnail(page, cat, reason)
+        # 1.5x full-page render per page; callers that discard them opt out
+        thumb = generate_debug_thumbnail(doc[i], cat, reason) if thumbnails else None
         
         results.append({
             "page": i+1,
@@ -1,10 +1,11 @@
 import fitz  # PyMuPDF
 import ollama
-import io
 import json
 import re
 from PIL import Image
 
+from pipeline.vlm_image import encode_vlm_png
+
 MODEL_NAME = "qwen3-vl:30b-a3b-instruct"
 
 # ==========================================
@@ -15,8 +16,8 @@ def extract_schedule_data(image):
     Extracts structured data from a Schedule Table.
     PRIORITY: Look for 'Mark', 'Tag', or 'Type' columns.
     """
-    byte_arr = io.BytesIO()
-    image.save(byte_arr, format='PNG')
+    # Dense small text with fractions: keep it lossless
+    img_bytes = encode_vlm_png(image)
     
     prompt = """
     Analyze this Architectural Schedule Table.
@@ -31,7 +32,7 @@ def extract_schedule_data(image):
     { "items": [ {"mark": "A", "width_str": "3'-0\"", "height_str": "7'-0\"", "category": "door"} ] }
     """
     try:
-        response = ollama.chat(model=MODEL_NAME, messages=[{'role': 'user', 'content': prompt, 'images': [byte_arr.getvalue()]}])
+        response = ollama.chat(model=MODEL_NAME, messages=[{'role': 'user', 'content': prompt, 'images': [img_bytes]}])
         match = re.search(r"\{.*\}", response['message']['content'], re.DOTALL)
         if match: return json.loads(match.group(0)).get("items", [])
     except: pass
@@ -44,8 +45,7 @@ def extract_visual_data(image):
     """
     Extracts types defined by drawings (Window Types).
     """
-    byte_arr = io.BytesIO()
-    image.save(byte_arr, format='PNG')
+    img_bytes = encode_vlm_png(image)
     
     prompt = """
     Analyze these Component Type drawings.
@@ -60,7 +60,7 @@ def extract_visual_data(image):
     { "items": [ {"mark": "W1", "width_str": "4'-0\"", "height_str": "6'-0\"", "category": "window"} ] }
     """
     try:
-        response = ollama.chat(model=MODEL_NAME, messages=[{'role': 'user', 'content': prompt, 'images': [byte_arr.getvalue()]}])
+        response = ollama.chat(model=MODEL_NAME, messages=[{'role': 'user', 'content': prompt, 'images': [img_bytes]}])
         match = re.search(r"\{.*\}", response['message']['content'], re.DOTALL)
         if match: return json.loads(match.group(0)).get("items", [])
     except: pass
@@ -83,9 +83,9 @@ def parse_dim(text):
 # ==========================================
 # 4. EXECUTE
 # ==========================================
-def execute(pdf_path, pages):
+def execute(pdf_path, pages, doc=None):
     print("--- [Phase 2] Smart Extraction ---")
-    doc = fitz.open(pdf_path)
+    if doc is None: doc = fitz.open(pdf_path)
     
     library = {"windows": {}, "doors": {}}
     debug_crops = [] # For main.py visualization
@@ -97,7 +97,7 @@ def execute(pdf_path, pages):
         # Use high-res for reading text
         page = doc[p_num-1]
         pix = page.get_pixmap(matrix=fitz.Matrix(2.0, 2.0))
-        img = Image.open(io.BytesIO(pix.tobytes("png")))
+        img = Image.frombytes("RGB", (pix.width, pix.height), pix.samples)
         
         # Logic Switch based on Phase 1 Classification
         items = []
@@ -1,15 +1,77 @@
 import fitz  # PyMuPDF
 import ollama
-import io
 import json
 import re
+import os
+import threading
+from functools import lru_cache
+from collections import OrderedDict
 import cv2
 import numpy as np
 from PIL import Image, ImageDraw
 from pipeline import USE_CUDA
+from pipeline.vlm_image import encode_vlm_jpeg
+from pipeline.page_pool import call_captured, run_page_batches, stop_requested
 
 MODEL_NAME = "qwen3-vl:30b-a3b-instruct"
 
+# One client per process: its httpx pool keeps the connection to Ollama
+# alive across the many per-view / per-candidate calls.
+_OLLAMA = ollama.Client(host=os.environ.get("OLLAMA_HOST", "http://localhost:11434"))
+
+# Sheets and view tiles go to the VLM as JPEG
+encode_vlm_image = encode_vlm_jpeg
+
+# Full-page renders shared by Phases 1/3/4/5 when they run in the same
+# process: 1x for view detection, 1.5x for debug sheets. Keyed on
+# (document path, page number, zoom); callers must treat the image as
+# read-only (copy before drawing). Bounded by pixel bytes, since a 1.5x ARCH D
+# sheet is ~30MB and a 1x one ~13MB. Concurrent runs share it, so every access
+# holds the lock (rendering itself happens outside it).
+PAGE_CACHE_MAX_BYTES = 320 * 1024 * 1024
+_PAGE_CACHE = OrderedDict()
+_page_cache_bytes = 0
+_PAGE_CACHE_LOCK = threading.Lock()
+
+def get_page_image(doc, page_num, zoom=1.0):
+    global _page_cache_bytes
+    key = (doc.name, page_num, zoom) if doc.name else None  # in-memory docs have no name
+    if key is not None:
+        with _PAGE_CACHE_LOCK:
+            img = _PAGE_CACHE.get(key)
+            if img is not None:
+                _PAGE_CACHE.move_to_end(key)
+                return img
+    pix = doc[page_num - 1].get_pixmap(matrix=fitz.Matrix(zoom, zoom), alpha=False)
+    img = Image.frombytes("RGB", (pix.width, pix.height), pix.samples)
+    if key is None: return img
+    with _PAGE_CACHE_LOCK:
+        if key in _PAGE_CACHE:  # another thread rendered it meanwhile
+            _PAGE_CACHE.move_to_end(key)
+            return _PAGE_CACHE[key]
+        _PAGE_CACHE[key] = img
+        _page_cache_bytes += img.width * img.height * 3
+        while _page_cache_bytes > PAGE_CACHE_MAX_BYTES and len(_PAGE_CACHE) > 1:
+            _, old = _PAGE_CACHE.popitem(last=False)
+            _page_cache_bytes -= old.width * old.height * 3
+    return img
+
+def get_low_res_page(doc, page_num):
+    return get_page_image(doc, page_num, 1.0)
+
+def clear_page_cache(doc_name=None):
+    """Drops the renders of one document (all documents if doc_name is None)."""
+    global _page_cache_bytes
+    with _PAGE_CACHE_LOCK:
+        for key in [k for k in _PAGE_CACHE if doc_name is None or k[0] == doc_name]:
+            old = _PAGE_CACHE.pop(key)
+            _page_cache_bytes -= old.width * old.height * 3
+
+def page_cost(doc, page_num):
+    """Relative work for a page: its area in points (proportional to pixels at any zoom)."""
+    rect = doc[page_num - 1].rect
+    return rect.width * rect.height
+
 # ==========================================
 # 1. VIEW DETECTOR (SAM3-Enhanced Global Scout)
 # ==========================================
@@ -104,9 +166,7 @@ def detect_drawing_views(page_image, use_sam3=True):
     
     # Fallback to VLM (original method)
     print("[VLM] Detecting views with Vision Language Model...")
-    byte_arr = io.BytesIO()
-    page_image.save(byte_arr, format='PNG')
-    img_bytes = byte_arr.getvalue()
+    img_bytes = encode_vlm_image(page_image)
 
     prompt = """
     Analyze this architectural sheet.
@@ -115,7 +175,7 @@ def detect_drawing_views(page_image, use_sam3=True):
     """
     
     try:
-        response = ollama.chat(model=MODEL_NAME, messages=[{'role': 'user', 'content': prompt, 'images': [img_bytes]}])
+        response = _OLLAMA.chat(model=MODEL_NAME, messages=[{'role': 'user', 'content': prompt, 'images': [img_bytes]}])
         content = response['message']['content']
         match = re.search(r"\{.*\}", content, re.DOTALL)
         if match: 
@@ -136,17 +196,26 @@ def detect_drawing_views(page_image, use_sam3=True):
 # ==========================================
 # 2. GEOFENCING ENGINE (The Spatial Filter)
 # ==========================================
-def generate_building_mask(page, crop_rect, dilation_px=50):
-    zoom = 2.0
+# The mask only answers "is this word centre on the building?", so it is
+# rendered at 1x. Sizes below are in PDF points and scaled by the zoom.
+MASK_ZOOM = 1.0
+MASK_DILATION_PT = 20
+
+@lru_cache(maxsize=None)
+def rect_kernel(w, h):
+    """Structuring elements are built once per size and shared (read-only)."""
+    return cv2.getStructuringElement(cv2.MORPH_RECT, (w, h))
+
+def generate_building_mask(page, crop_rect, dilation_px=50, zoom=2.0):
     mat = fitz.Matrix(zoom, zoom)
-    pix = page.get_pixmap(matrix=mat, clip=crop_rect)
-    img_data = np.frombuffer(pix.samples, dtype=np.uint8)
-    img = img_data.reshape(pix.height, pix.width, pix.n)
-    if pix.n >= 3: gray = cv2.cvtColor(img, cv2.COLOR_RGB2GRAY)
-    else: gray = img
+    # Only the >240 paper threshold is needed, so let MuPDF render gray directly
+    pix = page.get_pixmap(matrix=mat, clip=crop_rect, colorspace=fitz.csGRAY, alpha=False)
+    gray = np.frombuffer(pix.samples, dtype=np.uint8).reshape(pix.height, pix.width)
 
     _, binary = cv2.threshold(gray, 240, 255, cv2.THRESH_BINARY_INV)
-    kernel = np.ones((5,5), np.uint8)
+    # 5px at the original 2x zoom; keep the same ~2.5pt gap closing at any zoom
+    k = max(3, int(round(2.5 * zoom)) | 1)
+    kernel = rect_kernel(k, k)
 
     if USE_CUDA:
         gpu_src = cv2.cuda_GpuMat()
@@ -156,40 +225,74 @@ def generate_building_mask(page, crop_rect, dilation_px=50):
     else:
         closed = cv2.morphologyEx(binary, cv2.MORPH_CLOSE, kernel)
 
-    contours, _ = cv2.findContours(closed, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-    
-    mask = np.zeros_like(gray)
-    if not contours: return mask, gray.shape
+    # Fill enclosed background so each shape is solid (what filling its
+    # external contour gives): in the inverted image, label 0 is the ink and
+    # any background component not touching the border is a hole.
+    n_bg, bg_labels = cv2.connectedComponents(cv2.bitwise_not(closed), connectivity=4)
+    fill_lut = np.full(n_bg, 255, dtype=np.uint8)
+    fill_lut[np.unique(np.concatenate((bg_labels[0], bg_labels[-1], bg_labels[:, 0], bg_labels[:, -1])))] = 0
+    fill_lut[0] = 255
+    solid = fill_lut[bg_labels]
 
-    img_area = gray.shape[0] * gray.shape[1]
-    for cnt in contours:
-        area = cv2.contourArea(cnt)
-        if area > (img_area * 0.005) and area < (img_area * 0.95):
-            cv2.drawContours(mask, [cnt], -1, 255, -1)
+    # Keep mid-sized shapes: one labelling pass + a per-label lookup
+    n, labels, stats, _ = cv2.connectedComponentsWithStats(solid, connectivity=8)
+    img_area = solid.shape[0] * solid.shape[1]
+    areas = stats[:, cv2.CC_STAT_AREA]
+    keep = (areas > img_area * 0.005) & (areas < img_area * 0.95)
+    keep[0] = False  # background
+    mask = np.where(keep, 255, 0).astype(np.uint8)[labels]
 
     if dilation_px > 0:
-        kernel_dil = np.ones((dilation_px, dilation_px), np.uint8)
-        if USE_CUDA:
-            gpu_mask = cv2.cuda_GpuMat()
-            gpu_mask.upload(mask)
-            dil_filter = cv2.cuda.createMorphologyFilter(cv2.MORPH_DILATE, cv2.CV_8U, kernel_dil)
-            mask = dil_filter.apply(gpu_mask).download()
-        else:
-            mask = cv2.dilate(mask, kernel_dil, iterations=1)
+        mask = dilate_rect(mask, dilation_px)
 
     return mask, (pix.width, pix.height)
 
 
-def is_point_in_mask(pt, mask, mask_dims, crop_rect):
-    rel_x = pt[0] - crop_rect.x0
-    rel_y = pt[1] - crop_rect.y0
+def dilate_rect(mask, k):
+    """
+    Dilates by a k x k square. A rectangular max-filter is separable, so large
+    kernels run as a (k x 1) pass then a (1 x k) pass: 2k compares per pixel
+    instead of k*k, with identical output.
+    """
+    if k <= 5:
+        kernels = [rect_kernel(k, k)]
+    else:
+        kernels = [rect_kernel(k, 1), rect_kernel(1, k)]
+
+    if USE_CUDA:
+        gpu_mask = cv2.cuda_GpuMat()
+        gpu_mask.upload(mask)
+        for kernel in kernels:
+            dil_filter = cv2.cuda.createMorphologyFilter(cv2.MORPH_DILATE, cv2.CV_8U, kernel)
+            gpu_mask = dil_filter.apply(gpu_mask)
+        return gpu_mask.download()
+
+    for kernel in kernels:
+        mask = cv2.dilate(mask, kernel, iterations=1)
+    return mask
+
+
+def words_in_mask(words, mask, mask_dims, crop_rect):
+    """
+    Returns the words whose centre lies inside crop_rect and on the mask.
+    Tests every word in one NumPy pass instead of a per-word Python call.
+    """
+    if not words or crop_rect.is_empty: return []
+    boxes = np.array([w[:4] for w in words], dtype=np.float64)
+    cx = (boxes[:, 0] + boxes[:, 2]) * 0.5
+    cy = (boxes[:, 1] + boxes[:, 3]) * 0.5
+    inside = (cx >= crop_rect.x0) & (cx < crop_rect.x1) & (cy >= crop_rect.y0) & (cy < crop_rect.y1)
+
     scale_x = mask_dims[0] / crop_rect.width
     scale_y = mask_dims[1] / crop_rect.height
-    px = int(rel_x * scale_x)
-    py = int(rel_y * scale_y)
-    if 0 <= px < mask_dims[0] and 0 <= py < mask_dims[1]:
-        return mask[py, px] > 0
-    return False
+    px = ((cx - crop_rect.x0) * scale_x).astype(np.int64)
+    py = ((cy - crop_rect.y0) * scale_y).astype(np.int64)
+    mask_h, mask_w = mask.shape[:2]
+    inside &= (px >= 0) & (px < mask_w) & (py >= 0) & (py < mask_h)
+
+    idx = np.nonzero(inside)[0]
+    hits = mask[py[idx], px[idx]] > 0
+    return [words[i] for i in idx[hits]]
 
 # ==========================================
 # 3. TAG MATCHING AGENT (VALIDATOR ONLY)
@@ -214,11 +317,10 @@ def agent_verify_tags(tile_img, unique_candidates, known_tags):
     OUTPUT JSON: {{ "matches": ["W1", "A", "102"] }}
     """
     
-    byte_arr = io.BytesIO()
-    tile_img.save(byte_arr, format='PNG')
+    img_bytes = encode_vlm_image(tile_img)
     
     try:
-        response = ollama.chat(model=MODEL_NAME, messages=[{'role': 'user', 'content': prompt, 'images': [byte_arr.getvalue()]}])
+        response = _OLLAMA.chat(model=MODEL_NAME, messages=[{'role': 'user', 'content': prompt, 'images': [img_bytes]}])
         content = response['message']['content']
         match = re.search(r"\{.*\}", content, re.DOTALL)
         if match:
@@ -226,10 +328,144 @@ def agent_verify_tags(tile_img, unique_candidates, known_tags):
     except: pass
     return []
 
+def match_confirmed_types(texts, confirmed_types):
+    """
+    Maps each distinct OCR text to the first confirmed type it fuzzy-matches
+    ("W1" matches "W1" or "W1."), or None.
+    
+    Both directions go through hash lookups instead of scanning every type:
+      - type in text: look up the text's substrings of each type length
+      - text in type: look up the text in an index of every type substring
+    Tags are short, so both indexes stay tiny.
+    """
+    type_index = {}       # type -> first position in confirmed_types
+    substring_index = {}  # any substring of a type -> first position
+    for i, c_type in enumerate(confirmed_types):
+        type_index.setdefault(c_type, i)
+        n = len(c_type)
+        for a in range(n + 1):
+            for b in range(a, n + 1):
+                substring_index.setdefault(c_type[a:b], i)
+    type_lengths = sorted({len(t) for t in type_index})
+
+    matches = {}
+    for text in set(texts):
+        best = substring_index.get(text)
+        for n in type_lengths:
+            if n > len(text): break
+            for a in range(len(text) - n + 1):
+                i = type_index.get(text[a:a + n])
+                if i is not None and (best is None or i < best):
+                    best = i
+        matches[text] = confirmed_types[best] if best is not None else None
+    return matches
+
 # ==========================================
-# 4. PIPELINE ENTRY POINT
+# 4. PER-PAGE WORKER
 # ==========================================
-def execute(pdf_path, elevation_pages, project_specs):
+def _process_page(doc, page_num, known_tags):
+    """
+    Surveys a single elevation page. May run inside a worker process, so it
+    returns its log lines instead of printing them (the parent's LogCollector
+    only sees the parent's stdout).
+    Returns (page_num, page_results, debug_artifact, views, logs).
+    """
+    logs = [f"  > Processing Page {page_num}..."]
+    page_results = {}
+    debug_artifact = None
+    views = None
+    try:
+        page = doc[page_num - 1]
+        
+        # Cached, so an in-process run with Phase 1 thumbnails enabled reuses
+        # that render; in the runner (thumbnails off) and in pool workers this
+        # is a plain render.
+        debug_img = get_page_image(doc, page_num, 1.5).copy()
+        draw = ImageDraw.Draw(debug_img)
+        
+        sx = debug_img.width / page.rect.width
+        sy = debug_img.height / page.rect.height
+        
+        def draw_box(rect, color, width=3):
+            draw.rectangle([rect[0]*sx, rect[1]*sy, rect[2]*sx, rect[3]*sy], outline=color, width=width)
+
+        views = detect_drawing_views(get_low_res_page(doc, page_num))
+        
+        # Text depends only on the page — extract once, filter per view
+        page_words = page.get_text("words")
+        
+        for view in views:
+            label = view.get("label", "View")
+            box = view.get("box_1000", [0,0,1000,1000])
+            pdf_w, pdf_h = page.rect.width, page.rect.height
+            view_rect = fitz.Rect((box[0]/1000)*pdf_w, (box[1]/1000)*pdf_h, (box[2]/1000)*pdf_w, (box[3]/1000)*pdf_h)
+            
+            mask, mask_dims = generate_building_mask(page, view_rect, dilation_px=int(MASK_DILATION_PT * MASK_ZOOM), zoom=MASK_ZOOM)
+            draw_box([view_rect.x0, view_rect.y0, view_rect.x1, view_rect.y1], (0, 0, 255))
+            
+            # 1. OCR all text inside mask
+            valid_vectors = words_in_mask(page_words, mask, mask_dims, view_rect)
+
+            if valid_vectors:
+                pix_v = page.get_pixmap(matrix=fitz.Matrix(2.0, 2.0), clip=view_rect)
+                view_img = Image.frombytes("RGB", (pix_v.width, pix_v.height), pix_v.samples)
+                
+                # 2. Get Unique Strings for Validation
+                candidate_texts = list(set([v[4] for v in valid_vectors]))
+                
+                # 3. VLM Approves Types (e.g., "Yes, W1 is a tag")
+                confirmed_types = agent_verify_tags(view_img, candidate_texts, known_tags)
+                
+                # 4. PYTHON Counts Occurrences in Original List
+                text_matches = match_confirmed_types(candidate_texts, confirmed_types)
+                view_counts = {}
+                tag_boxes = []
+                for v in valid_vectors:
+                    matched_type = text_matches[v[4]]
+                    
+                    if matched_type:
+                        clean_tag = str(matched_type).strip().upper()
+                        view_counts[clean_tag] = view_counts.get(clean_tag, 0) + 1
+                        tag_boxes.append(v)
+                
+                for v in tag_boxes:
+                    draw_box(v, (0, 255, 0), width=3)
+                
+                if view_counts:
+                    page_results[label] = view_counts
+                    logs.append(f"    - {label}: Found {view_counts}")
+
+        debug_artifact = (debug_img, f"P{page_num} Geofence Results")
+        
+    except Exception as e:
+        logs.append(f"    [Error] P{page_num}: {e}")
+
+    return page_num, page_results, debug_artifact, views, logs
+
+def _page_error(page_num, error):
+    """Output entry for a page that could not be surveyed."""
+    return page_num, {}, None, None, [f"  > Processing Page {page_num}...", f"    [Error] P{page_num}: {error}"]
+
+def _process_pages(pdf_path, page_nums, known_tags):
+    """
+    Surveys a batch of pages. Opens the document once per batch so each
+    worker pays the xref/font setup a single time.
+    """
+    try:
+        doc = fitz.open(pdf_path)
+    except Exception as e:
+        return [_page_error(p, e) for p in page_nums]
+    try:
+        return [_page_error(p, "cancelled") if stop_requested()
+                else call_captured(_process_page, doc, p, known_tags)
+                for p in page_nums]
+    finally:
+        doc.close()
+
+# ==========================================
+# 5. PIPELINE ENTRY POINT
+# ==========================================
+def execute(pdf_path, elevation_pages, project_specs, num_workers=None, doc=None, should_stop=None):
     print(f"--- [Phase 3] Geofenced Surveying ---")
     
     known_tags = []
@@ -237,81 +473,31 @@ def execute(pdf_path, elevation_pages, project_specs):
     known_tags.extend(list(project_specs.get("doors", {}).keys()))
     known_tags = [t for t in known_tags if len(str(t)) < 10]
     
-    doc = fitz.open(pdf_path)
+    if num_workers is None:
+        num_workers = min(os.cpu_count() or 1, 4)
+    
     survey_results = {} 
     debug_artifacts = [] 
+    view_boxes = {}
 
-    for page_num in elevation_pages:
-        print(f"  > Processing Page {page_num}...")
-        try:
-            page = doc[page_num - 1]
-            survey_results[page_num] = {}
-            
-            pix_full = page.get_pixmap(matrix=fitz.Matrix(1.5, 1.5))
-            debug_img = Image.open(io.BytesIO(pix_full.tobytes("png")))
-            draw = ImageDraw.Draw(debug_img)
-            
-            def draw_box(rect, color, width=3):
-                sx = debug_img.width / page.rect.width
-                sy = debug_img.height / page.rect.height
-                draw.rectangle([rect[0]*sx, rect[1]*sy, rect[2]*sx, rect[3]*sy], outline=color, width=width)
-
-            pix_low = page.get_pixmap(matrix=fitz.Matrix(1.0, 1.0))
-            views = detect_drawing_views(Image.open(io.BytesIO(pix_low.tobytes("png"))))
-            
-            for view in views:
-                label = view.get("label", "View")
-                box = view.get("box_1000", [0,0,1000,1000])
-                pdf_w, pdf_h = page.rect.width, page.rect.height
-                view_rect = fitz.Rect((box[0]/1000)*pdf_w, (box[1]/1000)*pdf_h, (box[2]/1000)*pdf_w, (box[3]/1000)*pdf_h)
-                
-                mask, mask_dims = generate_building_mask(page, view_rect, dilation_px=40)
-                draw_box([view_rect.x0, view_rect.y0, view_rect.x1, view_rect.y1], (0, 0, 255))
-                
-                # 1. OCR all text inside mask
-                words = page.get_text("words")
-                valid_vectors = []
-                for w in words:
-                    center_pt = ((w[0]+w[2])/2, (w[1]+w[3])/2)
-                    if view_rect.contains(fitz.Point(center_pt)):
-                        if is_point_in_mask(center_pt, mask, mask_dims, view_rect):
-                            valid_vectors.append(w)
-
-                if valid_vectors:
-                    pix_v = page.get_pixmap(matrix=fitz.Matrix(2.0, 2.0), clip=view_rect)
-                    view_img = Image.open(io.BytesIO(pix_v.tobytes("png")))
-                    
-                    # 2. Get Unique Strings for Validation
-                    candidate_texts = list(set([v[4] for v in valid_vectors]))
-                    
-                    # 3. VLM Approves Types (e.g., "Yes, W1 is a tag")
-                    confirmed_types = agent_verify_tags(view_img, candidate_texts, known_tags)
-                    
-                    # 4. PYTHON Counts Occurrences in Original List
-                    view_counts = {}
-                    for v in valid_vectors:
-                        text = v[4]
-                        # Check if this text vector matches a confirmed type
-                        # Fuzzy match: "W1" matches "W1" or "W1."
-                        matched_type = None
-                        for c_type in confirmed_types:
-                            if c_type in text or text in c_type:
-                                matched_type = c_type
-                                break
-                        
-                        if matched_type:
-                            clean_tag = str(matched_type).strip().upper()
-                            view_counts[clean_tag] = view_counts.get(clean_tag, 0) + 1
-                            draw_box([v[0], v[1], v[2], v[3]], (0, 255, 0), width=3)
-                    
-                    if view_counts:
-                        survey_results[page_num][label] = view_counts
-                        print(f"    - {label}: Found {view_counts}")
+    if num_workers > 1 and len(elevation_pages) > 1:
+        costs = [page_cost(doc, p) for p in elevation_pages] if doc is not None else None
+        page_outputs = run_page_batches(_process_pages, pdf_path, elevation_pages, costs, num_workers,
+                                        _page_error, args=(known_tags,), should_stop=should_stop)
+    elif doc is not None:
+        # In-process: reuse the caller's open document
+        page_outputs = [call_captured(_process_page, doc, p, known_tags) for p in elevation_pages]
+    else:
+        page_outputs = _process_pages(pdf_path, elevation_pages, known_tags)
 
-            debug_artifacts.append((debug_img, f"P{page_num} Geofence Results"))
-            
-        except Exception as e:
-            print(f"    [Error] P{page_num}: {e}")
+    for page_num, page_results, debug_artifact, views, logs in page_outputs:
+        for line in logs:
+            print(line)
+        survey_results[page_num] = page_results
+        if views is not None:
+            view_boxes[page_num] = views
+        if debug_artifact:
+            debug_artifacts.append(debug_artifact)
 
     print(f"--- [Phase 3] Complete. ---")
-    return survey_results, debug_artifacts
\ No newline at end of file
+    return survey_results, debug_artifacts, view_boxes
\ No newline at end of file
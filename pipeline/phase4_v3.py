@@ -1,18 +1,42 @@
 import fitz  # PyMuPDF
 import ollama
-import io
 import json
 import re
-import math
+import os
+import numpy as np
 import logging
 from PIL import Image, ImageDraw
 
+# 1x page renders are shared with Phase 3 when both run in this process
+try:
+    from pipeline.phase3_v4 import get_low_res_page
+except:
+    def get_low_res_page(doc, page_num):
+        pix = doc[page_num - 1].get_pixmap(matrix=fitz.Matrix(1, 1), alpha=False)
+        return Image.frombytes("RGB", (pix.width, pix.height), pix.samples)
+from pipeline.page_pool import run_page_batches, stop_requested
+from pipeline.vlm_image import encode_vlm_png
+
 # --- LOGGING ---
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
 MODEL_NAME = "qwen3-vl:30b-a3b-instruct"
 
+# One client per process: its httpx pool keeps the connection to Ollama
+# alive across the many per-view / per-candidate calls.
+_OLLAMA = ollama.Client(host=os.environ.get("OLLAMA_HOST", "http://localhost:11434"))
+
+# ==========================================
+# HELPER: IMAGE I/O
+# ==========================================
+# Line drawings stay lossless
+encode_vlm_image = encode_vlm_png
+
+def pix_to_image(pix):
+    """Wraps pixmap samples as a PIL image without a PNG encode/decode round trip."""
+    return Image.frombytes("RGB", (pix.width, pix.height), pix.samples)
+
 # ==========================================
 # HELPER: BULLETPROOF JSON PARSER
 # ==========================================
@@ -32,9 +56,7 @@ def extract_json(content):
 # ==========================================
 def agent_segregate_views(page_image):
     logger.info("--- AGENT 1: Segregating Views ---")
-    byte_arr = io.BytesIO()
-    page_image.save(byte_arr, format='PNG')
-    img_bytes = byte_arr.getvalue()
+    img_bytes = encode_vlm_image(page_image)
 
     prompt = """
     Analyze this sheet.
@@ -42,7 +64,7 @@ def agent_segregate_views(page_image):
     OUTPUT JSON: {"views": [{"label": "Name", "box_1000": [x0, y0, x1, y1]}]}
     """
     try:
-        response = ollama.chat(model=MODEL_NAME, messages=[{'role': 'user', 'content': prompt, 'images': [img_bytes]}])
+        response = _OLLAMA.chat(model=MODEL_NAME, messages=[{'role': 'user', 'content': prompt, 'images': [img_bytes]}])
         data = extract_json(response['message']['content'])
         if data: return data.get("views", [])
     except Exception as e:
@@ -55,9 +77,7 @@ def agent_segregate_views(page_image):
 # ==========================================
 def agent_decide_orientation(view_image):
     logger.info("--- AGENT 2: Deciding Orientation ---")
-    byte_arr = io.BytesIO()
-    view_image.save(byte_arr, format='PNG')
-    img_bytes = byte_arr.getvalue()
+    img_bytes = encode_vlm_image(view_image)
 
     prompt = """
     Act as an Architect.
@@ -70,7 +90,7 @@ def agent_decide_orientation(view_image):
     OUTPUT JSON: {"orientation": "VERTICAL" or "HORIZONTAL", "reason": "..."}
     """
     try:
-        response = ollama.chat(model=MODEL_NAME, messages=[{'role': 'user', 'content': prompt, 'images': [img_bytes]}])
+        response = _OLLAMA.chat(model=MODEL_NAME, messages=[{'role': 'user', 'content': prompt, 'images': [img_bytes]}])
         data = extract_json(response['message']['content'])
         if data: return data.get("orientation", "VERTICAL").upper()
     except Exception as e:
@@ -80,67 +100,110 @@ def agent_decide_orientation(view_image):
 # ==========================================
 # PYTHON: GLOBAL VECTOR EXTRACTION
 # ==========================================
+ANCHOR_PATTERN = re.compile(r".*\d.*['\"-].*")
+ANCHOR_FORBIDDEN = ["EL", "T.O.", "SIM", "TYP", "LEVEL", "CL", "GRID"]
+
+ANCHOR_RADIUS = 120
+
+def nearest_anchor(mid_x, mid_y, anchor_xy, radius):
+    """
+    Nearest anchor per line midpoint, only looking within `radius`.
+    Anchors are bucketed on a radius-sized grid, so each group of lines in the
+    same cell is compared against the 3x3 neighbouring cells only.
+    Returns (nearest_idx, dist); dist is inf where no anchor is in range.
+    """
+    nearest = np.zeros(len(mid_x), dtype=np.int64)
+    best_dist = np.full(len(mid_x), np.inf)
+    if len(mid_x) == 0 or len(anchor_xy) == 0:
+        return nearest, best_dist
+
+    a_cells = np.floor(anchor_xy / radius).astype(np.int64)
+    grid = {}
+    for idx, (cx, cy) in enumerate(map(tuple, a_cells)):
+        grid.setdefault((cx, cy), []).append(idx)
+
+    m_cells = np.floor(np.column_stack((mid_x, mid_y)) / radius).astype(np.int64)
+    cells, inverse = np.unique(m_cells, axis=0, return_inverse=True)
+    inverse = inverse.reshape(-1)
+    rows_by_cell = np.split(np.argsort(inverse, kind="stable"), np.cumsum(np.bincount(inverse))[:-1])
+    for (cx, cy), rows in zip(map(tuple, cells), rows_by_cell):
+        near = [i for dx in (-1, 0, 1) for dy in (-1, 0, 1) for i in grid.get((cx + dx, cy + dy), ())]
+        if not near: continue
+        near = np.array(sorted(near))  # ascending, so argmin ties match a full scan
+        d = np.sqrt((mid_x[rows, None] - anchor_xy[near, 0])**2 + (mid_y[rows, None] - anchor_xy[near, 1])**2)
+        best = d.argmin(axis=1)
+        nearest[rows] = near[best]
+        best_dist[rows] = d[np.arange(len(rows)), best]
+    return nearest, best_dist
+
 def extract_vectors_global(page, view_rect, orientation, view_logs):
     logger.info(f"--- PYTHON: Scanning view for {orientation} vectors ---")
     
     words = page.get_text("words")
     anchors = []
-    strict_pattern = re.compile(r".*\d.*['\"-].*")
-    forbidden = ["EL", "T.O.", "SIM", "TYP", "LEVEL", "CL", "GRID"]
-
-    # 1. Collect Anchors
-    for w in words:
-        pt = fitz.Point(w[0], w[1])
-        if view_rect.contains(pt):
-            clean_text = w[4].strip()
-            if strict_pattern.match(clean_text):
-                if not any(bad in clean_text.upper() for bad in forbidden):
-                    anchors.append({
-                        "text": clean_text, 
-                        "center": fitz.Point((w[0]+w[2])/2, (w[1]+w[3])/2)
-                    })
+    vr = view_rect
+
+    # 1. Collect Anchors (one array test for view containment, regex only on survivors)
+    if words:
+        wx = np.fromiter((w[0] for w in words), dtype=np.float64, count=len(words))
+        wy = np.fromiter((w[1] for w in words), dtype=np.float64, count=len(words))
+        inside_words = np.nonzero((wx >= vr.x0) & (wx < vr.x1) & (wy >= vr.y0) & (wy < vr.y1))[0]
+    else:
+        inside_words = []
+    for idx in inside_words:
+        w = words[idx]
+        clean_text = w[4].strip()
+        if ANCHOR_PATTERN.match(clean_text):
+            if not any(bad in clean_text.upper() for bad in ANCHOR_FORBIDDEN):
+                anchors.append({
+                    "text": clean_text, 
+                    "center": fitz.Point((w[0]+w[2])/2, (w[1]+w[3])/2)
+                })
     
     if not anchors:
         view_logs.append("  Debug: No valid text anchors found.")
         return []
 
-    # 2. Extract Lines
+    # 2. Extract Lines (structure-of-arrays: one row per segment)
+    # Skip whole paths whose bbox misses the view. Compared by hand because
+    # Rect.intersects treats the zero-height bbox of a horizontal line as empty.
     drawings = page.get_drawings()
+    segs = [(item[1].x, item[1].y, item[2].x, item[2].y)
+            for path in drawings
+            if path['rect'].x1 >= vr.x0 and path['rect'].x0 <= vr.x1
+            and path['rect'].y1 >= vr.y0 and path['rect'].y0 <= vr.y1
+            for item in path['items'] if item[0] == 'l']
     candidates = []
     
-    for path in drawings:
-        for item in path['items']:
-            if item[0] == 'l':
-                p1, p2 = item[1], item[2]
-                if not (view_rect.contains(p1) and view_rect.contains(p2)): continue
-                
-                length = math.sqrt((p2.x - p1.x)**2 + (p2.y - p1.y)**2)
-                if length < 25: continue 
-                
-                is_horz = abs(p1.y - p2.y) < 2.0
-                is_vert = abs(p1.x - p2.x) < 2.0
-                
-                if orientation == "VERTICAL" and not is_vert: continue
-                if orientation == "HORIZONTAL" and not is_horz: continue
-                if not (is_horz or is_vert): continue
-
-                mid = fitz.Point((p1.x+p2.x)/2, (p1.y+p2.y)/2)
-                best_dist = 10000
-                best_anchor = None
-                
-                for anchor in anchors:
-                    d = math.sqrt((mid.x-anchor['center'].x)**2 + (mid.y-anchor['center'].y)**2)
-                    if d < 120: 
-                        if d < best_dist:
-                            best_dist = d
-                            best_anchor = anchor
-                        
-                if best_anchor:
-                    candidates.append({
-                        "p1": p1, "p2": p2, "len": length,
-                        "anchor_text": best_anchor['text'],
-                        "score": best_dist
-                    })
+    if segs:
+        x1, y1, x2, y2 = np.array(segs, dtype=np.float64).T
+        # Containment first, so everything below only touches in-view lines
+        inside = ((x1 >= vr.x0) & (x1 < vr.x1) & (y1 >= vr.y0) & (y1 < vr.y1) &
+                  (x2 >= vr.x0) & (x2 < vr.x1) & (y2 >= vr.y0) & (y2 < vr.y1))
+        x1, y1, x2, y2 = x1[inside], y1[inside], x2[inside], y2[inside]
+        
+        length = np.sqrt((x2 - x1)**2 + (y2 - y1)**2)
+        is_horz = np.abs(y1 - y2) < 2.0
+        is_vert = np.abs(x1 - x2) < 2.0
+        if orientation == "VERTICAL": orient_ok = is_vert
+        elif orientation == "HORIZONTAL": orient_ok = is_horz
+        else: orient_ok = is_horz | is_vert
+        keep = np.nonzero((length >= 25) & orient_ok)[0]
+        
+        anchor_xy = np.array([(a['center'].x, a['center'].y) for a in anchors], dtype=np.float64)
+        mid_x = (x1[keep] + x2[keep]) / 2
+        mid_y = (y1[keep] + y2[keep]) / 2
+        nearest, best_dist = nearest_anchor(mid_x, mid_y, anchor_xy, ANCHOR_RADIUS)
+        
+        for row in np.nonzero(best_dist < ANCHOR_RADIUS)[0]:
+            i = keep[row]
+            candidates.append({
+                "p1": fitz.Point(float(x1[i]), float(y1[i])),
+                "p2": fitz.Point(float(x2[i]), float(y2[i])),
+                "len": float(length[i]),
+                "anchor_text": anchors[nearest[row]]['text'],
+                "score": float(best_dist[row])
+            })
     
     view_logs.append(f"  Debug: Found {len(candidates)} {orientation} candidates.")
     candidates.sort(key=lambda x: x['score'])
@@ -183,7 +246,7 @@ def agent_validate_vector(img_bytes, vector, orientation):
     
     for _ in range(2): 
         try:
-            response = ollama.chat(model=MODEL_NAME, messages=[{'role': 'user', 'content': prompt, 'images': [img_bytes]}])
+            response = _OLLAMA.chat(model=MODEL_NAME, messages=[{'role': 'user', 'content': prompt, 'images': [img_bytes]}])
             content = response['message']['content']
             data = extract_json(content)
             if data: return data
@@ -191,20 +254,82 @@ def agent_validate_vector(img_bytes, vector, orientation):
             
     return {"verdict": "ERROR", "reason": "VLM Failed"}
 
+def agent_validate_vectors(images_bytes, vectors, orientation):
+    """Validates all candidates of a view in one multi-image request, which also
+    returns the dimension reading for VALID lines. Entries the batch reply does
+    not cover are None; the caller re-checks those one by one as it reaches them."""
+    results = [None] * len(vectors)
+
+    if len(vectors) >= 2:
+        anchors = "\n".join(f'    - Image {n+1}: Anchor Text is "{v["anchor_text"]}".' for n, v in enumerate(vectors))
+        prompt = f"""
+    You are a Calibration Auditor.
+    CONTEXT:
+    - We are validating {orientation} Dimensions.
+    - You are given {len(vectors)} images, numbered 1 to {len(vectors)} in order.
+{anchors}
+    
+    IN EACH IMAGE, LOOK AT THE BLUE HIGHLIGHTED LINE.
+    
+    TASK: For each image, determine if the blue line is a valid dimension line.
+    For VALID lines, also read the dimension text associated with the blue line.
+    
+    CRITERIA:
+    1. Does the line connect two specific points (e.g. floor lines, grid lines)?
+    2. Is the text clearly associated with this line?
+    
+    OUTPUT JSON: 
+    {{ 
+      "verdicts": [ {{"id": 1, "verdict": "VALID" or "INVALID", "value": "4'-0\\"" or "", "reason": "..."}} ]
+    }}
+    """
+        logger.info(f"--- AGENT 3: Validating {len(vectors)} Vectors (batch) ---")
+
+        try:
+            response = _OLLAMA.chat(model=MODEL_NAME, messages=[{'role': 'user', 'content': prompt, 'images': list(images_bytes)}])
+            data = extract_json(response['message']['content'])
+            for item in (data or {}).get("verdicts", []):
+                n = int(item.get("id", 0)) - 1
+                if 0 <= n < len(vectors) and item.get("verdict") in ("VALID", "INVALID"):
+                    results[n] = item
+        except Exception as e:
+            logger.error(f"Batch Validation Error: {e}")
+
+    return results
+
 # ==========================================
 # AGENT 4: READER & PARSER
 # ==========================================
 def agent_read_scale(img_bytes):
     prompt = "Read the dimension text associated with the BLUE LINE. Return ONLY the value (e.g. 4'-0\")."
     try:
-        response = ollama.chat(model=MODEL_NAME, messages=[{'role': 'user', 'content': prompt, 'images': [img_bytes]}])
+        response = _OLLAMA.chat(model=MODEL_NAME, messages=[{'role': 'user', 'content': prompt, 'images': [img_bytes]}])
         return response['message']['content'].strip()
     except: return ""
 
+_RE_FEET_FRAC = re.compile(r"(\d+)'\s*-?\s*(\d+)?(?:[ ]+(\d+)/(\d+))?")
+_RE_FEET_DEC = re.compile(r"(\d+)'\s*(\d+(?:\.\d+)?)\"")
+
+def _parse_feet_simple(clean):
+    """Fast path for the plain N'-M" / N' forms. Returns None for anything else."""
+    head, sep, tail = clean.partition("'")
+    if not sep or not (head.isascii() and head.isdigit()):
+        return None
+    if tail.startswith("-"): tail = tail[1:]
+    if tail.endswith('"'): tail = tail[:-1]
+    if not tail:
+        return float(head)
+    if tail.isascii() and tail.isdigit():
+        return float(head) + float(tail)/12.0
+    return None
+
 def parse_feet(dim_str):
     if not dim_str: return None
     clean = dim_str.replace("’", "'").replace("”", '"').strip()
-    match = re.search(r"(\d+)'\s*-?\s*(\d+)?(?:[ ]+(\d+)/(\d+))?", clean)
+    fast = _parse_feet_simple(clean)
+    if fast is not None: return fast
+    
+    match = _RE_FEET_FRAC.search(clean)
     if match:
         f = float(match.group(1))
         i = float(match.group(2)) if match.group(2) else 0
@@ -212,7 +337,7 @@ def parse_feet(dim_str):
         den = float(match.group(4)) if match.group(4) else 1
         return f + (i + (num/den))/12.0
     
-    match_dec = re.search(r"(\d+)'\s*(\d+(?:\.\d+)?)\"", clean)
+    match_dec = _RE_FEET_DEC.search(clean)
     if match_dec:
         f = float(match_dec.group(1))
         i = float(match_dec.group(2))
@@ -220,23 +345,52 @@ def parse_feet(dim_str):
         
     return None
 
-def generate_highlighted_image(page, vector):
-    margin = 150 
+HIGHLIGHT_ZOOM = 3.0
+HIGHLIGHT_MARGIN = 150
+# Cap on one highlight render (~72MB RGB); a 3x ARCH D sheet would be ~120MB
+# per worker, so only the candidates' region is rendered and the zoom drops
+# if even that is too large.
+HIGHLIGHT_MAX_PIXELS = 24_000_000
+
+def render_candidates_region(page, vectors, zoom=HIGHLIGHT_ZOOM):
+    """
+    Renders the union of the candidates' crop boxes once. Returns
+    (array, x_offset_px, y_offset_px, zoom) for generate_highlighted_image.
+    """
+    m = HIGHLIGHT_MARGIN
+    clip = fitz.Rect(
+        min(min(v['p1'].x, v['p2'].x) for v in vectors) - m,
+        min(min(v['p1'].y, v['p2'].y) for v in vectors) - m,
+        max(max(v['p1'].x, v['p2'].x) for v in vectors) + m,
+        max(max(v['p1'].y, v['p2'].y) for v in vectors) + m,
+    ) & page.rect
+    area = clip.width * clip.height
+    if area * zoom * zoom > HIGHLIGHT_MAX_PIXELS:
+        zoom = (HIGHLIGHT_MAX_PIXELS / area) ** 0.5
+    pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), clip=clip, alpha=False)
+    arr = np.frombuffer(pix.samples, dtype=np.uint8).reshape(pix.height, pix.width, pix.n)
+    ox, oy = pix.x, pix.y
+    pix = None
+    return arr, ox, oy, zoom
+
+def generate_highlighted_image(region, vector):
+    """Crops around the vector from the region render and draws it in blue."""
+    region_np, ox, oy, zoom = region
+    margin = HIGHLIGHT_MARGIN
     p1, p2 = vector['p1'], vector['p2']
-    x0 = max(0, min(p1.x, p2.x) - margin)
-    y0 = max(0, min(p1.y, p2.y) - margin)
-    x1 = min(page.rect.width, max(p1.x, p2.x) + margin)
-    y1 = min(page.rect.height, max(p1.y, p2.y) + margin)
-    crop = fitz.Rect(x0, y0, x1, y1)
-
-    pix = page.get_pixmap(matrix=fitz.Matrix(3.0, 3.0), clip=crop)
-    img = Image.open(io.BytesIO(pix.tobytes("png")))
+    h, w = region_np.shape[:2]
+    # Page pixel coordinates at this zoom, shifted into the region
+    x0 = max(0, int((min(p1.x, p2.x) - margin) * zoom) - ox)
+    y0 = max(0, int((min(p1.y, p2.y) - margin) * zoom) - oy)
+    x1 = min(w, int(np.ceil((max(p1.x, p2.x) + margin) * zoom)) - ox)
+    y1 = min(h, int(np.ceil((max(p1.y, p2.y) + margin) * zoom)) - oy)
+
+    img = Image.fromarray(region_np[y0:y1, x0:x1])
     draw = ImageDraw.Draw(img)
-    sx, sy = img.width/crop.width, img.height/crop.height
     
     draw.line([
-        (p1.x-crop.x0)*sx, (p1.y-crop.y0)*sy,
-        (p2.x-crop.x0)*sx, (p2.y-crop.y0)*sy
+        p1.x*zoom - ox - x0, p1.y*zoom - oy - y0,
+        p2.x*zoom - ox - x0, p2.y*zoom - oy - y0
     ], fill="blue", width=6)
     
     return img
@@ -244,64 +398,134 @@ def generate_highlighted_image(page, vector):
 # ==========================================
 # 5. PIPELINE ENTRY POINT
 # ==========================================
-def execute(pdf_path, elevation_pages):
-    print(f"--- [Phase 4] Chain-of-Thought Calibration ---")
-    doc = fitz.open(pdf_path)
-    scale_data = {} 
-    debug_artifacts = [] 
-    
-    for page_num in elevation_pages:
-        print(f"  > Calibrating Page {page_num}...")
-        try:
-            page = doc[page_num - 1]
-            scale_data[page_num] = {}
-            pdf_w, pdf_h = page.rect.width, page.rect.height
+def _calibrate_page(doc, page_num):
+    """
+    Calibrates one page. May run inside a worker process, so log lines are
+    returned rather than printed (LogCollector only sees the parent's stdout).
+    Returns (page_num, page_scales, page_artifacts, logs).
+    """
+    logs = [f"  > Calibrating Page {page_num}..."]
+    page_scales = {}
+    page_artifacts = []
+    try:
+        page = doc[page_num - 1]
+        pdf_w, pdf_h = page.rect.width, page.rect.height
+        
+        full_img = get_low_res_page(doc, page_num)
+        views_data = agent_segregate_views(full_img)
+        
+        for i, v_data in enumerate(views_data):
+            label = v_data.get("label", f"View {i+1}")
+            box = v_data.get("box_1000", [0,0,1000,1000])
+            view_rect = fitz.Rect((box[0]/1000)*pdf_w, (box[1]/1000)*pdf_h, (box[2]/1000)*pdf_w, (box[3]/1000)*pdf_h)
             
-            pix = page.get_pixmap(matrix=fitz.Matrix(1,1))
-            full_img = Image.open(io.BytesIO(pix.tobytes("png")))
-            views_data = agent_segregate_views(full_img)
+            # Same zoom as the full render, so crop it instead of re-rasterising
+            view_img = full_img.crop((
+                max(0, int(view_rect.x0)), max(0, int(view_rect.y0)),
+                min(full_img.width, int(np.ceil(view_rect.x1))), min(full_img.height, int(np.ceil(view_rect.y1)))
+            ))
             
-            for i, v_data in enumerate(views_data):
-                label = v_data.get("label", f"View {i+1}")
-                box = v_data.get("box_1000", [0,0,1000,1000])
-                view_rect = fitz.Rect((box[0]/1000)*pdf_w, (box[1]/1000)*pdf_h, (box[2]/1000)*pdf_w, (box[3]/1000)*pdf_h)
-                
-                pix_v = page.get_pixmap(matrix=fitz.Matrix(1,1), clip=view_rect)
-                view_img = Image.open(io.BytesIO(pix_v.tobytes("png")))
-                
-                view_logs = []
-                orientation = agent_decide_orientation(view_img)
-                vectors = extract_vectors_global(page, view_rect, orientation, view_logs)
+            view_logs = []
+            orientation = agent_decide_orientation(view_img)
+            vectors = extract_vectors_global(page, view_rect, orientation, view_logs)
+            
+            success_flag = False
+            
+            # One render per view, covering just its candidates
+            region = render_candidates_region(page, vectors) if vectors else None
+            images = [generate_highlighted_image(region, vec) for vec in vectors]
+            region = None
+            images_bytes = [encode_vlm_image(img) for img in images]
+            verdicts = agent_validate_vectors(images_bytes, vectors, orientation)
+            
+            for j, vec in enumerate(vectors):
+                img, img_bytes, val_res = images[j], images_bytes[j], verdicts[j]
+                if val_res is None:
+                    # Not covered by the batch reply; checked only if no
+                    # earlier candidate was VALID (the loop breaks on success)
+                    val_res = agent_validate_vector(img_bytes, vec, orientation)
+                verdict = val_res.get("verdict", "INVALID")
                 
-                success_flag = False
+                status = f"{label} Candidate {j+1}: {verdict}"
+                page_artifacts.append((img, f"P{page_num} {status}"))
                 
-                for j, vec in enumerate(vectors):
-                    img = generate_highlighted_image(page, vec)
-                    byte_arr = io.BytesIO()
-                    img.save(byte_arr, format='PNG')
-                    img_bytes = byte_arr.getvalue()
-                    
-                    val_res = agent_validate_vector(img_bytes, vec, orientation)
-                    verdict = val_res.get("verdict", "INVALID")
-                    
-                    status = f"{label} Candidate {j+1}: {verdict}"
-                    debug_artifacts.append((img, f"P{page_num} {status}"))
-                    
-                    if verdict == "VALID":
+                if verdict == "VALID":
+                    # The batch verdict may already carry the reading; only ask
+                    # the reader agent when it is missing or unparseable.
+                    val_str = str(val_res.get("value") or "").strip()
+                    feet = parse_feet(val_str)
+                    if not (feet and feet > 0.5):
                         val_str = agent_read_scale(img_bytes)
                         feet = parse_feet(val_str)
-                        if feet and feet > 0.5:
-                            scale = vec['len'] / feet
-                            scale_data[page_num][label] = scale
-                            print(f"    - {label}: SUCCESS. Scale = {scale:.2f} pts/ft (Ref: {val_str})")
-                            debug_artifacts[-1] = (img, f"P{page_num} {label} Scale={scale:.2f} (Ref: {val_str})")
-                            success_flag = True
-                            break 
-                
-                if not success_flag:
-                    print(f"    - {label}: FAILED. All candidates rejected.")
+                    if feet and feet > 0.5:
+                        scale = vec['len'] / feet
+                        page_scales[label] = scale
+                        logs.append(f"    - {label}: SUCCESS. Scale = {scale:.2f} pts/ft (Ref: {val_str})")
+                        page_artifacts[-1] = (img, f"P{page_num} {label} Scale={scale:.2f} (Ref: {val_str})")
+                        success_flag = True
+                        break 
+            
+            if not success_flag:
+                logs.append(f"    - {label}: FAILED. All candidates rejected.")
 
-        except Exception as e:
-            print(f"    [Error] P{page_num}: {e}")
+    except Exception as e:
+        logs.append(f"    [Error] P{page_num}: {e}")
+
+    return page_num, page_scales, page_artifacts, logs
+
+def _page_error(page_num, error):
+    """Output entry for a page that could not be calibrated."""
+    return page_num, {}, [], [f"  > Calibrating Page {page_num}...", f"    [Error] P{page_num}: {error}"]
+
+def _calibrate_pages(pdf_path, page_nums):
+    """Calibrates a batch of pages with a single open of the document."""
+    try:
+        doc = fitz.open(pdf_path)
+    except Exception as e:
+        return [_page_error(p, e) for p in page_nums]
+    try:
+        return [_page_error(p, "cancelled") if stop_requested() else _calibrate_page(doc, p)
+                for p in page_nums]
+    finally:
+        doc.close()
+
+def calibrate(pdf_path, elevation_pages, num_workers=None, doc=None, isolate=False, page_costs=None,
+              should_stop=None):
+    """
+    Runs the calibration without printing. Returns the per-page outputs for
+    report(). With isolate=True every page runs in a spawned worker, so this
+    can be called from a background thread while the caller keeps using
+    PyMuPDF on its own thread. page_costs (one per page) balance the worker
+    batches; without them pages are dealt round-robin. should_stop is polled
+    while workers run (isolated/pool path only).
+    """
+    if not elevation_pages:
+        return []
+    if num_workers is None:
+        num_workers = min(os.cpu_count() or 1, 4)
+    
+    if isolate or (num_workers > 1 and len(elevation_pages) > 1):
+        return run_page_batches(_calibrate_pages, pdf_path, elevation_pages, page_costs, num_workers,
+                                _page_error, should_stop=should_stop)
+    elif doc is not None:
+        # In-process: reuse the caller's open document
+        return [_calibrate_page(doc, p) for p in elevation_pages]
+    else:
+        return _calibrate_pages(pdf_path, elevation_pages)
+
+def report(page_outputs):
+    """Prints the phase log in page order and merges the per-page results."""
+    print(f"--- [Phase 4] Chain-of-Thought Calibration ---")
+    scale_data = {} 
+    debug_artifacts = [] 
+    
+    for page_num, page_scales, page_artifacts, logs in page_outputs:
+        for line in logs:
+            print(line)
+        scale_data[page_num] = page_scales
+        debug_artifacts.extend(page_artifacts)
+
+    return scale_data, debug_artifacts
 
-    return scale_data, debug_artifacts
\ No newline at end of file
+def execute(pdf_path, elevation_pages, num_workers=None, doc=None):
+    return report(calibrate(pdf_path, elevation_pages, num_workers=num_workers, doc=doc))
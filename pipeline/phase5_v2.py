@@ -1,42 +1,61 @@
 import fitz  # PyMuPDF
 import cv2
 import numpy as np
-import io
 import re
+import os
+from functools import lru_cache
 from PIL import Image
 
-# Import the view detector to ensure consistent cropping
-# (Ideally, we would pass the view boxes from Phase 3/4 to Phase 5 to avoid re-detection drift)
-# For robustness, let's reuse the detector logic here or import it.
+# View boxes normally come from Phase 3 (same detector, so labels match survey_data).
+# The detector is only re-run for pages Phase 3 did not report boxes for.
 try:
-    from pipeline.phase3_v4 import detect_drawing_views
+    from pipeline.phase3_v4 import detect_drawing_views, get_low_res_page, page_cost
 except:
     def detect_drawing_views(img): return [{"label": "Full Page", "box_1000": [0,0,1000,1000]}]
+    def page_cost(doc, page_num): return 1.0
+    def get_low_res_page(doc, page_num):
+        pix = doc[page_num - 1].get_pixmap(matrix=fitz.Matrix(1.0, 1.0), alpha=False)
+        return Image.frombytes("RGB", (pix.width, pix.height), pix.samples)
+from pipeline.page_pool import call_captured, run_page_batches, stop_requested
 
 # ==========================================
 # 1. HELPER: DEDUCTION CALCULATOR
 # ==========================================
-def get_deduction_line_items(view_counts, project_specs, page_num, view_label):
-    line_items = []
-    total_deduction_area = 0.0
-    
-    # Flatten library
+def build_type_index(project_specs):
+    """
+    Flattens the window/door library once per run. Alongside the dict it keeps
+    each key's position and the first position of every dash-less key, so the
+    fuzzy match is two hash lookups instead of a scan over the library.
+    """
     all_types = {}
     all_types.update(project_specs.get('windows', {}))
     all_types.update(project_specs.get('doors', {}))
 
+    items = list(all_types.items())
+    key_pos = {key: pos for pos, (key, _) in enumerate(items)}
+    nodash_pos = {}
+    for pos, (key, _) in enumerate(items):
+        nodash_pos.setdefault(key.replace("-", ""), pos)
+    return all_types, items, key_pos, nodash_pos
+
+def lookup_spec(clean_tag, type_index):
+    all_types, items, key_pos, nodash_pos = type_index
+    if clean_tag in all_types:
+        return all_types[clean_tag]
+    # Fuzzy match: first library entry where either side matches without dashes
+    hits = [p for p in (nodash_pos.get(clean_tag), key_pos.get(clean_tag.replace("-", ""))) if p is not None]
+    return items[min(hits)][1] if hits else None
+
+def get_deduction_line_items(view_counts, project_specs, page_num, view_label, type_index=None):
+    line_items = []
+    total_deduction_area = 0.0
+    
+    if type_index is None:
+        type_index = build_type_index(project_specs)
+
     for tag, count in view_counts.items():
         clean_tag = str(tag).upper().replace("TYPE", "").strip()
-        spec = None
-        
-        if clean_tag in all_types:
-            spec = all_types[clean_tag]
-        else:
-            # Fuzzy match
-            for key, val in all_types.items():
-                if clean_tag == key.replace("-", "") or key == clean_tag.replace("-", ""):
-                    spec = val
-                    break
+        spec = lookup_spec(clean_tag, type_index)
         
         if spec:
             try:
@@ -66,9 +85,32 @@ def get_deduction_line_items(view_counts, project_specs, page_num, view_label):
 # ==========================================
 # 2. VECTOR ENGINE
 # ==========================================
-def get_vector_mask_area(page, crop_rect, px_per_ft_base):
-    # Render at 300 DPI (Zoom 4.0) for precision
-    zoom = 4.0 
+@lru_cache(maxsize=None)
+def rect_kernel(w, h):
+    """Structuring elements are built once per size and shared (read-only)."""
+    return cv2.getStructuringElement(cv2.MORPH_RECT, (w, h))
+
+def close_rect(binary, k):
+    """
+    Closing by a k x k square, run as (k x 1) / (1 x k) passes for both the
+    dilate and the erode. A rectangular max/min filter is separable, so the
+    result is identical to MORPH_CLOSE with the full square.
+    """
+    row, col = rect_kernel(k, 1), rect_kernel(1, k)
+    out = cv2.dilate(cv2.dilate(binary, row), col)
+    return cv2.erode(cv2.erode(out, row), col)
+
+# 144 DPI is plenty for a facade outline: area error stays far below the
+# sub-foot precision the sqft output needs, at a quarter of the pixels of 4.0.
+CONTOUR_ZOOM = 2.0
+# Views below this gross area are dropped, so no overlay is drawn for them
+MIN_GROSS_SQFT = 50
+
+def get_vector_mask_area(page, crop_rect, px_per_ft_base, zoom=CONTOUR_ZOOM, debug_min_sqft=0.0):
+    """
+    Returns (gross_sqft, debug_image). The debug overlay is only built when
+    gross_sqft reaches debug_min_sqft; otherwise debug_image is None.
+    """
     mat = fitz.Matrix(zoom, zoom)
     
     try:
@@ -82,136 +124,206 @@ def get_vector_mask_area(page, crop_rect, px_per_ft_base):
     else:
         gray = img
 
+    # Blank crop (nothing darker than the 240 threshold): no contours possible.
+    # A strided probe finds ink cheaply on real drawings; only an ink-free
+    # probe pays for the full scan.
+    if gray.size == 0 or (gray[::8, ::8].min() > 240 and gray.min() > 240):
+        return 0.0, (Image.fromarray(gray) if debug_min_sqft <= 0 else None)
+
     # Binarize & Morph
     _, binary = cv2.threshold(gray, 240, 255, cv2.THRESH_BINARY_INV)
-    kernel = np.ones((5,5), np.uint8)
-    closed = cv2.morphologyEx(binary, cv2.MORPH_CLOSE, kernel)
+    # 5px at the original 4x zoom; keep the same ~1.25pt gap closing at any zoom
+    closed = close_rect(binary, max(3, int(round(1.25 * zoom)) | 1))
 
     # Find Contours
     contours, _ = cv2.findContours(closed, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
     
-    if not contours: return 0.0, Image.fromarray(gray)
+    if not contours: return 0.0, (Image.fromarray(gray) if debug_min_sqft <= 0 else None)
 
-    # Smart Filter
+    # Smart Filter: areas once as an array, bounding boxes only for the survivors
     img_h, img_w = gray.shape
     total_area = img_h * img_w
-    valid_contours = []
-    
-    for cnt in contours:
-        area_px = cv2.contourArea(cnt)
-        if area_px < (total_area * 0.005): continue # Too small (noise)
-        if area_px > (total_area * 0.95): continue # Too big (border)
-        
-        _, _, cw, ch = cv2.boundingRect(cnt)
-        if ch > 0:
-            aspect = cw/ch
-            if aspect > 40 or aspect < 0.02: continue # Lines
-            
-        valid_contours.append(cnt)
+    areas = np.fromiter((cv2.contourArea(c) for c in contours), dtype=np.float64, count=len(contours))
+    # Too small (noise) / too big (border)
+    sized = np.nonzero((areas >= total_area * 0.005) & (areas <= total_area * 0.95))[0]
+    if len(sized):
+        # Bounding boxes for all survivors at once: min/max per contour via
+        # reduceat over the concatenated points (+1 = boundingRect's inclusive size)
+        pts = np.concatenate([contours[i].reshape(-1, 2) for i in sized])
+        starts = np.concatenate(([0], np.cumsum([len(contours[i]) for i in sized])[:-1]))
+        lo = np.minimum.reduceat(pts, starts, axis=0)
+        hi = np.maximum.reduceat(pts, starts, axis=0)
+        cw = (hi[:, 0] - lo[:, 0] + 1).astype(np.float64)
+        ch = (hi[:, 1] - lo[:, 1] + 1).astype(np.float64)
+        aspect = np.divide(cw, ch, out=np.ones_like(cw), where=ch > 0)
+        sized = sized[(aspect <= 40) & (aspect >= 0.02)] # Lines
     
-    if not valid_contours: return 0.0, Image.fromarray(gray)
+    if not len(sized): return 0.0, (Image.fromarray(gray) if debug_min_sqft <= 0 else None)
 
-    # Pick largest valid shape
-    target_cnt = max(valid_contours, key=cv2.contourArea)
-    area_px_zoom = cv2.contourArea(target_cnt)
+    # Pick largest valid shape (argmax keeps the first on ties, like max())
+    best = sized[np.argmax(areas[sized])]
+    target_cnt = contours[best]
+    area_px_zoom = float(areas[best])
     
     # Calculate Square Footage
     # Real Scale = Base Scale * Zoom Factor
     real_scale = px_per_ft_base * zoom
     gross_sqft = area_px_zoom / (real_scale ** 2) if real_scale > 0 else 0
+    if gross_sqft < debug_min_sqft: return gross_sqft, None
     
     # Draw Green Overlay
+    # Outside the filled contour both inputs are the same gray pixel, so the
+    # blend is a no-op there; only the contour's bounding box is blended.
     vis_img = cv2.cvtColor(gray, cv2.COLOR_GRAY2RGB)
+    x, y, w, h = cv2.boundingRect(target_cnt)
+    base_roi = vis_img[y:y+h, x:x+w].copy()
     cv2.drawContours(vis_img, [target_cnt], -1, (0, 255, 0), -1)
     alpha = 0.4
-    overlay = cv2.addWeighted(vis_img, alpha, cv2.cvtColor(gray, cv2.COLOR_GRAY2RGB), 1 - alpha, 0)
+    vis_img[y:y+h, x:x+w] = cv2.addWeighted(vis_img[y:y+h, x:x+w], alpha, base_roi, 1 - alpha, 0)
     
-    return gross_sqft, Image.fromarray(overlay)
+    return gross_sqft, Image.fromarray(vis_img)
 
 # ==========================================
 # 3. PIPELINE ENTRY POINT
 # ==========================================
-def execute(pdf_path, survey_data, scale_data, project_specs):
+def _estimate_page(doc, page_num, views, page_scales, page_views, project_specs, type_index):
+    """
+    Gross/deduction/net for one page. May run inside a worker process, so log
+    lines are returned rather than printed.
+    Returns (line_items, view_nets, gallery, logs).
+    """
+    logs = [f"  > Processing P{page_num}..."]
+    line_items = []
+    view_nets = []
+    gallery = []
+    
+    page = doc[page_num - 1]
+    
+    # Reuse Phase 3 crop boxes; re-detect only when they are missing
+    detected_views = page_views
+    if detected_views is None:
+        detected_views = detect_drawing_views(get_low_res_page(doc, page_num))
+    
+    for view_meta in detected_views:
+        label = view_meta.get("label", "Main")
+        box_1000 = view_meta.get("box_1000")
+        
+        # Match View Label to Scale Data
+        # Logic: Look for exact match, then fuzzy match in scale_data keys
+        view_scale = 0.0
+        
+        if label in page_scales:
+            view_scale = page_scales[label]
+        else:
+            # Fallback: Use any available scale for this page
+            if page_scales:
+                view_scale = list(page_scales.values())[0]
+        
+        if view_scale < 1.0: continue
+
+        # Crop Rect
+        w, h = page.rect.width, page.rect.height
+        crop_rect = fitz.Rect(
+            (box_1000[0]/1000)*w, (box_1000[1]/1000)*h,
+            (box_1000[2]/1000)*w, (box_1000[3]/1000)*h
+        )
+        
+        # 1. Gross Calc
+        gross_sqft, debug_img = get_vector_mask_area(page, crop_rect, view_scale, debug_min_sqft=MIN_GROSS_SQFT)
+        if gross_sqft < MIN_GROSS_SQFT: continue
+
+        # 2. Deduction Calc
+        # Find matching survey counts for this view
+        view_tags = views.get(label, {})
+        # If label mismatch, try to merge all counts on page? 
+        # Safe bet: If survey has specific view keys, use them. If generic, use generic.
+        if not view_tags and len(views) == 1:
+            view_tags = list(views.values())[0]
+
+        deduct_items, deduct_total = get_deduction_line_items(view_tags, project_specs, page_num, label, type_index)
+        
+        # 3. Sanity Clamp (Max 40% deduction)
+        clamped_deduct = deduct_total
+        note = ""
+        if deduct_total > (gross_sqft * 0.40):
+            clamped_deduct = gross_sqft * 0.40
+            note = " (Auto-Clamped)"
+            ratio = clamped_deduct / deduct_total if deduct_total > 0 else 0
+            for item in deduct_items:
+                item['Total_SF'] *= ratio
+                item['Description'] += " [Clamped]"
+
+        net_sqft = gross_sqft - clamped_deduct
+        view_nets.append(net_sqft)
+        
+        # Add to Report
+        line_items.append({
+            "Page": page_num, "View": label, "Category": "EIFS Wall",
+            "Description": "Gross Facade Area (Vector)", "Dimensions": "-",
+            "Count": 1, "Unit_SF": round(gross_sqft, 2), "Total_SF": round(gross_sqft, 2)
+        })
+        line_items.extend(deduct_items)
+        
+        gallery.append((debug_img, f"P{page_num} {label}\nNet: {net_sqft:.0f} sf{note}"))
+        logs.append(f"    - {label}: Gross {gross_sqft:.0f} - Ded {clamped_deduct:.0f} = Net {net_sqft:.0f}")
+
+    return line_items, view_nets, gallery, logs
+
+def _job_error(job, error):
+    """Output entry for a page job that could not be estimated."""
+    return [], [], [], [f"  > Processing P{job[0]}...", f"    [Error] P{job[0]}: {error}"]
+
+def _estimate_pages(pdf_path, jobs, project_specs, type_index):
+    """
+    Runs a batch of page jobs with a single open of the document. Prints from
+    a fallback view detection are kept with the page's log lines.
+    """
+    try:
+        doc = fitz.open(pdf_path)
+    except Exception as e:
+        return [_job_error(job, e) for job in jobs]
+    try:
+        return [_job_error(job, "cancelled") if stop_requested()
+                else call_captured(_estimate_page, doc, *job, project_specs, type_index)
+                for job in jobs]
+    finally:
+        doc.close()
+
+def execute(pdf_path, survey_data, scale_data, project_specs, view_boxes=None, num_workers=None, doc=None, should_stop=None):
     print(f"--- [Phase 5] Detailed Vector Estimation ---")
-    doc = fitz.open(pdf_path)
     
     all_line_items = []
     debug_gallery = []
     grand_total_net = 0.0
+    type_index = build_type_index(project_specs)
     
-    # Iterate through pages
-    for page_num, views in survey_data.items():
-        if page_num not in scale_data: continue
-        print(f"  > Processing P{page_num}...")
-        
-        page = doc[page_num - 1]
-        
-        # Re-detect views to get crop boxes
-        pix_low = page.get_pixmap(matrix=fitz.Matrix(1.0, 1.0))
-        detected_views = detect_drawing_views(Image.open(io.BytesIO(pix_low.tobytes("png"))))
-        
-        for view_meta in detected_views:
-            label = view_meta.get("label", "Main")
-            box_1000 = view_meta.get("box_1000")
-            
-            # Match View Label to Scale Data
-            # Logic: Look for exact match, then fuzzy match in scale_data keys
-            view_scale = 0.0
-            page_scales = scale_data[page_num]
-            
-            if label in page_scales:
-                view_scale = page_scales[label]
-            else:
-                # Fallback: Use any available scale for this page
-                if page_scales:
-                    view_scale = list(page_scales.values())[0]
-            
-            if view_scale < 1.0: continue
-
-            # Crop Rect
-            w, h = page.rect.width, page.rect.height
-            crop_rect = fitz.Rect(
-                (box_1000[0]/1000)*w, (box_1000[1]/1000)*h,
-                (box_1000[2]/1000)*w, (box_1000[3]/1000)*h
-            )
-            
-            # 1. Gross Calc
-            gross_sqft, debug_img = get_vector_mask_area(page, crop_rect, view_scale)
-            if gross_sqft < 50: continue
-
-            # 2. Deduction Calc
-            # Find matching survey counts for this view
-            view_tags = views.get(label, {})
-            # If label mismatch, try to merge all counts on page? 
-            # Safe bet: If survey has specific view keys, use them. If generic, use generic.
-            if not view_tags and len(views) == 1:
-                view_tags = list(views.values())[0]
-
-            deduct_items, deduct_total = get_deduction_line_items(view_tags, project_specs, page_num, label)
-            
-            # 3. Sanity Clamp (Max 40% deduction)
-            clamped_deduct = deduct_total
-            note = ""
-            if deduct_total > (gross_sqft * 0.40):
-                clamped_deduct = gross_sqft * 0.40
-                note = " (Auto-Clamped)"
-                ratio = clamped_deduct / deduct_total if deduct_total > 0 else 0
-                for item in deduct_items:
-                    item['Total_SF'] *= ratio
-                    item['Description'] += " [Clamped]"
-
-            net_sqft = gross_sqft - clamped_deduct
+    jobs = [(page_num, views, scale_data[page_num], (view_boxes or {}).get(page_num))
+            for page_num, views in survey_data.items() if page_num in scale_data]
+    
+    if num_workers is None:
+        num_workers = min(os.cpu_count() or 1, 4)
+    
+    if num_workers > 1 and len(jobs) > 1:
+        # Each view is a separate contour pass, so weight the page by its views.
+        if doc is not None:
+            costs = [page_cost(doc, job[0]) * max(1, len(job[1])) for job in jobs]
+        else:
+            costs = [max(1, len(job[1])) for job in jobs]
+        page_outputs = run_page_batches(_estimate_pages, pdf_path, jobs, costs, num_workers,
+                                        _job_error, args=(project_specs, type_index), should_stop=should_stop)
+    elif doc is not None:
+        # In-process: reuse the caller's open document
+        page_outputs = [call_captured(_estimate_page, doc, *job, project_specs, type_index) for job in jobs]
+    else:
+        page_outputs = _estimate_pages(pdf_path, jobs, project_specs, type_index)
+    
+    # Merge in page order so totals and logs match a sequential run
+    for line_items, view_nets, gallery, logs in page_outputs:
+        for line in logs:
+            print(line)
+        all_line_items.extend(line_items)
+        for net_sqft in view_nets:
             grand_total_net += net_sqft
-            
-            # Add to Report
-            all_line_items.append({
-                "Page": page_num, "View": label, "Category": "EIFS Wall",
-                "Description": "Gross Facade Area (Vector)", "Dimensions": "-",
-                "Count": 1, "Unit_SF": round(gross_sqft, 2), "Total_SF": round(gross_sqft, 2)
-            })
-            all_line_items.extend(deduct_items)
-            
-            debug_gallery.append((debug_img, f"P{page_num} {label}\nNet: {net_sqft:.0f} sf{note}"))
-            print(f"    - {label}: Gross {gross_sqft:.0f} - Ded {clamped_deduct:.0f} = Net {net_sqft:.0f}")
+        debug_gallery.extend(gallery)
 
-    return all_line_items, grand_total_net, debug_gallery
\ No newline at end of file
+    return all_line_items, grand_total_net, debug_gallery
@@ -9,9 +9,13 @@ from pipeline import (
 from pipeline.debug_pdf_collector import collect_and_write_debug_pdf
 from pipeline.validator import validate_step
 from pipeline.log_collector import LogCollector
+from pipeline.phase3_v4 import clear_page_cache, page_cost
 
 import os
 import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import fitz  # PyMuPDF
 from datetime import datetime
 # MongoDB Connection for heartbeat updates
 # Avoid initializing here to prevent double connection / DNS timeout on import
@@ -21,6 +25,8 @@ runs_collection = None
 cancel_event = threading.Event()
 
 _HEARTBEAT_INTERVAL = 30  # seconds between background heartbeats
+_HEARTBEAT_MIN_GAP = 5  # phase-boundary heartbeats closer than this are coalesced
+_VALIDATOR_WORKERS = 8  # concurrent validator requests to Ollama
 
 
 def is_cancelled():
@@ -28,10 +34,21 @@ def is_cancelled():
     return cancel_event.is_set()
 
 
+_last_heartbeat = {}
+_last_heartbeat_lock = threading.Lock()
+
+
 def update_heartbeat(run_id: str, collection=None):
     """Update last_updated timestamp to show pipeline is alive"""
     target_collection = collection or runs_collection
     if target_collection is not None and run_id:
+        # Quick phases fire heartbeats back to back; one write per gap is
+        # enough for the timeout monitor, which works in minutes.
+        now = time.monotonic()
+        with _last_heartbeat_lock:
+            if now - _last_heartbeat.get(run_id, float("-inf")) < _HEARTBEAT_MIN_GAP:
+                return
+            _last_heartbeat[run_id] = now
         try:
             target_collection.update_one(
                 {"run_id": run_id},
@@ -81,6 +98,8 @@ class _HeartbeatThread:
         self._stop.set()
         if self._thread:
             self._thread.join(timeout=5)
+        with _last_heartbeat_lock:
+            _last_heartbeat.pop(self.run_id, None)
 
 
 def run_pipeline(pdf_path: str, run_id: str = None):
@@ -100,13 +119,20 @@ def run_pipeline(pdf_path: str, run_id: str = None):
 
     log("Starting pipeline")
 
+    # One parsed document for every phase that runs in this process
+    doc = None
+    phase4_runner = None
+    phase4_stop = threading.Event()
+
     try:
+        doc = fitz.open(pdf_path)
+
         # -------------------------
         # PHASE 1
         # -------------------------
         update_heartbeat(run_id)
         with log_collector.capture_phase("phase1"):
-            actionable_pages = phase1_v3.execute(pdf_path)
+            actionable_pages = phase1_v3.execute(pdf_path, doc=doc, thumbnails=False)
 
         elevation_pages = [
             p["page"]
@@ -116,20 +142,35 @@ def run_pipeline(pdf_path: str, run_id: str = None):
 
         # Phase 1 thumbnails are just re-renders of original pages with
         # a colored border — not real pipeline output.  Original pages are
-        # already saved as page_N.pdf, so skip phase1 debug images.
-        phase1_debug = []
+        # already saved as page_N.pdf, so they are not rendered at all.
 
         update_progress(run_id, "Phase 1: PDF Processing Complete", 20)
 
+        # Phase 4 only needs the elevation page list, so start it now. It runs
+        # in its own worker processes (PyMuPDF must stay on this thread) while
+        # Phases 2 and 3 continue here; its log is printed in the Phase 4 block.
+        phase4_runner = ThreadPoolExecutor(max_workers=1)
+        phase4_future = phase4_runner.submit(
+            phase4_v3.calibrate,
+            pdf_path,
+            elevation_pages,
+            isolate=True,
+            page_costs=[page_cost(doc, p) for p in elevation_pages],
+            should_stop=lambda: is_cancelled() or phase4_stop.is_set(),
+        )
+
         # -------------------------
         # PHASE 2
         # -------------------------
         update_heartbeat(run_id)
         with log_collector.capture_phase("phase2"):
-            project_specs, phase2_debug = phase2_v3.execute(
+            # Phase 2 debug crops are unmodified page renders that never reach
+            # the debug PDF; drop them here rather than hold them all run.
+            project_specs = phase2_v3.execute(
                 pdf_path,
                 actionable_pages,
-            )
+                doc=doc,
+            )[0]
 
         update_progress(run_id, "Phase 2: Element Detection Complete", 40)
 
@@ -138,10 +179,12 @@ def run_pipeline(pdf_path: str, run_id: str = None):
         # -------------------------
         update_heartbeat(run_id)
         with log_collector.capture_phase("phase3"):
-            survey_data, phase3_debug = phase3_v4.execute(
+            survey_data, phase3_debug, view_boxes = phase3_v4.execute(
                 pdf_path,
                 elevation_pages,
                 project_specs,
+                doc=doc,
+                should_stop=is_cancelled,
             )
 
         update_progress(run_id, "Phase 3: Dimension Extraction Complete", 60)
@@ -151,10 +194,7 @@ def run_pipeline(pdf_path: str, run_id: str = None):
         # -------------------------
         update_heartbeat(run_id)
         with log_collector.capture_phase("phase4"):
-            scale_data, phase4_debug = phase4_v3.execute(
-                pdf_path,
-                elevation_pages,
-            )
+            scale_data, phase4_debug = phase4_v3.report(phase4_future.result())
 
         update_progress(run_id, "Phase 4: Scale Analysis Complete", 80)
 
@@ -168,6 +208,9 @@ def run_pipeline(pdf_path: str, run_id: str = None):
                 survey_data,
                 scale_data,
                 project_specs,
+                view_boxes=view_boxes,
+                doc=doc,
+                should_stop=is_cancelled,
             )
 
         update_progress(run_id, "Phase 5: Output Generation Complete", 100)
@@ -178,23 +221,34 @@ def run_pipeline(pdf_path: str, run_id: str = None):
 
         validator_scores = []
 
-        for phase_debug in [
-            phase3_debug,
-            phase4_debug,
-            phase5_debug,
-        ]:
-
-            if not phase_debug:
-                continue
+        artifacts = [
+            (img, label)
+            for phase_debug in [
+                phase3_debug,
+                phase4_debug,
+                phase5_debug,
+            ]
+            if phase_debug
+            for img, label in phase_debug
+        ]
 
-            for img, label in phase_debug:
+        # Each artifact is an independent VLM round trip; run them
+        # concurrently and collect the scores in artifact order.
+        with ThreadPoolExecutor(max_workers=_VALIDATOR_WORKERS) as executor:
+            futures = [
+                executor.submit(
+                    validate_step,
+                    img,
+                    candidate_data={"label": label},
+                    phase_context="Pipeline Debug Artifact",
+                )
+                for img, label in artifacts
+            ]
+
+            for future in futures:
 
                 try:
-                    res = validate_step(
-                        img,
-                        candidate_data={"label": label},
-                        phase_context="Pipeline Debug Artifact",
-                    )
+                    res = future.result()
 
                     score = float(res.get("confidence_score", 0.0))
                     validator_scores.append(score)
@@ -250,5 +304,11 @@ def run_pipeline(pdf_path: str, run_id: str = None):
             "phase_logs": log_collector.get_all_logs()
         }
     finally:
+        if doc is not None:
+            doc.close()
+        clear_page_cache(pdf_path)  # only this run's renders
+        if phase4_runner is not None:
+            phase4_stop.set()  # workers stop before their next page
+            phase4_runner.shutdown(wait=False, cancel_futures=True)
         hb.stop()
 
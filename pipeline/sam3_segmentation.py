@@ -33,40 +33,126 @@ ROBOFLOW_API_URL = ROBOFLOW_API_URL.rstrip("/")
 # ==========================================
 # ROBOFLOW INFERENCE CLIENT
 # ==========================================
-import requests
+import httpx
 import base64
 import json
+import hashlib
+import threading
+from collections import OrderedDict
+
+# "json" (base64 image in a JSON body) or "multipart" (raw JPEG bytes as a
+# form file, ~25% smaller upload, no base64 pass). Multipart needs an
+# inference server build that accepts form uploads on concept_segment.
+ROBOFLOW_UPLOAD = os.getenv("ROBOFLOW_UPLOAD", "json").lower()
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Optional: PyTurboJPEG calls libjpeg-turbo directly on the RGB buffer,
+# skipping the PIL Image wrap. Same quality/subsampling as the PIL path.
+try:
+    from turbojpeg import TurboJPEG, TJPF_RGB, TJSAMP_420
+    _TJ = TurboJPEG()
+except Exception:
+    _TJ = None
+
+JPEG_QUALITY = 75
+
+def encode_jpeg(image_array):
+    if _TJ is not None and image_array.ndim == 3 and image_array.shape[2] == 3 and image_array.dtype == np.uint8:
+        return _TJ.encode(np.ascontiguousarray(image_array), quality=JPEG_QUALITY, pixel_format=TJPF_RGB, jpeg_subsample=TJSAMP_420)
+    with io.BytesIO() as buffered:
+        Image.fromarray(image_array).save(buffered, format="JPEG", quality=JPEG_QUALITY)
+        return buffered.getvalue()
+
+# One pooled client per process so TCP/TLS setup is reused across pages.
+# HTTP/2 (needs the optional h2 package) multiplexes concurrent requests over
+# one TLS connection to an https endpoint; plain http stays on HTTP/1.1.
+try:
+    import h2  # noqa: F401
+    _HTTP2 = True
+except ImportError:
+    _HTTP2 = False
+
+_CLIENT = httpx.Client(
+    http2=_HTTP2,
+    limits=httpx.Limits(max_connections=16, max_keepalive_connections=16),
+    timeout=30.0,
+)
+
+# Parsed masks keyed on (JPEG content hash, prompts). Reruns and repeat pages
+# skip the network round trip. In-process only; failures are never cached.
+ROBOFLOW_CACHE_MAX = int(os.getenv("ROBOFLOW_CACHE_MAX", "128"))
+_RF_CACHE = OrderedDict()
+_RF_CACHE_LOCK = threading.Lock()
+
+def _rf_cache_get(key):
+    with _RF_CACHE_LOCK:
+        masks = _RF_CACHE.get(key)
+        if masks is None:
+            return None
+        _RF_CACHE.move_to_end(key)
+    # Fresh dicts/arrays so callers can mutate their copy
+    return [dict(m, segmentation=m['segmentation'].copy()) for m in masks]
+
+def _rf_cache_put(key, masks):
+    if ROBOFLOW_CACHE_MAX <= 0:
+        return
+    with _RF_CACHE_LOCK:
+        _RF_CACHE[key] = [dict(m, segmentation=m['segmentation'].copy()) for m in masks]
+        _RF_CACHE.move_to_end(key)
+        while len(_RF_CACHE) > ROBOFLOW_CACHE_MAX:
+            _RF_CACHE.popitem(last=False)
+
+def poly_mask(shape, pts):
+    """Filled polygon as a bool mask: fill 1s into uint8 and reinterpret, no compare pass."""
+    mask = np.zeros(shape, dtype=np.uint8)
+    cv2.fillPoly(mask, [pts], 1)
+    return mask.view(np.bool_)
 
 def roboflow_infer(image_array, prompts=["building", "elevation"]):
     """
     Send inference request to Roboflow Docker container.
     """
     try:
-        # Convert numpy array to PIL Image for JPEG encoding
-        img_pil = Image.fromarray(image_array)
-        buffered = io.BytesIO()
-        img_pil.save(buffered, format="JPEG")
-        img_base64 = base64.b64encode(buffered.getvalue()).decode("utf-8")
+        jpeg_bytes = encode_jpeg(image_array)
 
         # Prepare payload - handle list of prompts
         if isinstance(prompts, str):
             prompts = [prompts]
 
-        prompt_payload = [{"type": "text", "text": p} for p in prompts]
+        cache_key = (hashlib.blake2b(jpeg_bytes, digest_size=16).hexdigest(), tuple(prompts))
+        cached = _rf_cache_get(cache_key)
+        if cached is not None:
+            print(f"[Roboflow] Cache hit ({len(cached)} objects)")
+            return cached
 
-        payload = {
-            "image": {"type": "base64", "value": img_base64},
-            "model_id": ROBOFLOW_MODEL_ID,
-            "prompts": prompt_payload,
-        }
+        prompt_payload = [{"type": "text", "text": p} for p in prompts]
 
         url = f"{ROBOFLOW_API_URL}/sam3/concept_segment?api_key={ROBOFLOW_API_KEY}"
         print(f"[Roboflow] Sending request to {ROBOFLOW_API_URL}...")
 
-        response = requests.post(url, json=payload, timeout=30)
+        if ROBOFLOW_UPLOAD == "multipart":
+            response = _CLIENT.post(
+                url,
+                files={"image": ("img.jpg", jpeg_bytes, "image/jpeg")},
+                data={"model_id": ROBOFLOW_MODEL_ID, "prompts": json.dumps(prompt_payload)},
+            )
+        else:
+            payload = {
+                "image": {"type": "base64", "value": base64.b64encode(jpeg_bytes).decode("ascii")},
+                "model_id": ROBOFLOW_MODEL_ID,
+                "prompts": prompt_payload,
+            }
+            if orjson is not None:
+                response = _CLIENT.post(url, content=orjson.dumps(payload), headers={"Content-Type": "application/json"})
+            else:
+                response = _CLIENT.post(url, json=payload)
         response.raise_for_status()
 
-        result = response.json()
+        result = orjson.loads(response.content) if orjson is not None else response.json()
         masks = []
 
         try:
@@ -91,14 +177,13 @@ def roboflow_infer(image_array, prompts=["building", "elevation"]):
                 if "points" in pred:
                     pts = np.array([[p["x"], p["y"]] for p in pred["points"]], np.int32)
 
-                    mask = np.zeros(image_array.shape[:2], dtype=np.uint8)
-                    cv2.fillPoly(mask, [pts], 255)
+                    mask = poly_mask(image_array.shape[:2], pts)
 
                     area = cv2.contourArea(pts)
                     x, y, w, h = cv2.boundingRect(pts)
 
                     masks.append({
-                        'segmentation': mask > 0,
+                        'segmentation': mask,
                         'area': area,
                         'bbox': [x, y, w, h],
                         'predicted_iou': pred.get('confidence', 1.0),
@@ -116,14 +201,13 @@ def roboflow_infer(image_array, prompts=["building", "elevation"]):
                             else:
                                 pts = np.array(contour, dtype=np.int32)
 
-                            mask = np.zeros(image_array.shape[:2], dtype=np.uint8)
-                            cv2.fillPoly(mask, [pts], 255)
+                            mask = poly_mask(image_array.shape[:2], pts)
 
                             area = cv2.contourArea(pts)
                             x, y, w, h = cv2.boundingRect(pts)
 
                             masks.append({
-                                'segmentation': mask > 0,
+                                'segmentation': mask,
                                 'area': area,
                                 'bbox': [x, y, w, h],
                                 'predicted_iou': pred.get('confidence', 1.0),
@@ -132,6 +216,7 @@ def roboflow_infer(image_array, prompts=["building", "elevation"]):
                             })
 
             print(f"[Roboflow] Success! Detected {len(masks)} objects")
+            _rf_cache_put(cache_key, masks)
             return masks
 
         except Exception as e:
@@ -139,7 +224,7 @@ def roboflow_infer(image_array, prompts=["building", "elevation"]):
             print(f"[Roboflow] Raw result: {json.dumps(result)}")
             return None
 
-    except requests.exceptions.HTTPError as e:
+    except httpx.HTTPStatusError as e:
         print(f"[Roboflow] HTTP Error: {e}")
         return None
     except Exception as e:
@@ -158,21 +243,16 @@ def segment_building_automatic(image: np.ndarray, prompt="elevation", min_area_r
         
         if masks_info and len(masks_info) > 0:
             img_area = image.shape[0] * image.shape[1]
-            valid_masks = []
+            areas = np.fromiter((m['area'] for m in masks_info), dtype=np.float64, count=len(masks_info))
+            ratios = areas / img_area
+            keep = (ratios >= min_area_ratio) & (ratios <= max_area_ratio)
             
-            for mask_info in masks_info:
-                area = mask_info['area']
-                area_ratio = area / img_area
-                
-                if area_ratio < min_area_ratio or area_ratio > max_area_ratio:
-                    continue
-                valid_masks.append(mask_info)
-            
-            if not valid_masks:
+            if not keep.any():
                 return None, []
             
-            # Use largest valid mask as primary
-            best_mask_info = max(valid_masks, key=lambda x: x['area'])
+            valid_masks = [m for m, k in zip(masks_info, keep) if k]
+            # Use largest valid mask as primary (first one on ties, as max() did)
+            best_mask_info = masks_info[int(np.argmax(np.where(keep, areas, -1.0)))]
             best_mask = best_mask_info['segmentation'].astype(np.uint8) * 255
             return best_mask, valid_masks
             
@@ -195,8 +275,49 @@ def segment_building_with_box(image, box):
 # ==========================================
 # OPENCV FALLBACK
 # ==========================================
+def dilate_square(mask, px):
+    """
+    Dilates by a px x px square as a (1 x px) pass then a (px x 1) pass.
+    Same output as the full square kernel at 2*px compares per pixel, not px*px.
+    """
+    kernels = [np.ones((1, px), np.uint8), np.ones((px, 1), np.uint8)]
+    if USE_CUDA:
+        gpu_mask = cv2.cuda_GpuMat()
+        gpu_mask.upload(mask)
+        for kernel in kernels:
+            dil_filter = cv2.cuda.createMorphologyFilter(cv2.MORPH_DILATE, cv2.CV_8U, kernel)
+            gpu_mask = dil_filter.apply(gpu_mask)
+        return gpu_mask.download()
+    for kernel in kernels:
+        mask = cv2.dilate(mask, kernel)
+    return mask
+
+def _poly_areas(contours):
+    """Shoelace areas of all contours in one vectorised pass (== cv2.contourArea)."""
+    lens = np.fromiter((len(c) for c in contours), dtype=np.intp, count=len(contours))
+    pts = np.concatenate(contours).reshape(-1, 2).astype(np.float64)
+    starts = np.zeros(len(lens), dtype=np.intp)
+    np.cumsum(lens[:-1], out=starts[1:])
+    nxt = np.arange(1, len(pts) + 1)
+    nxt[starts + lens - 1] = starts
+    x, y = pts[:, 0], pts[:, 1]
+    cross = x * y[nxt] - x[nxt] * y
+    return np.abs(np.add.reduceat(cross, starts)) * 0.5
+
+FALLBACK_MAX_SIDE = 1500
+
 def segment_building_opencv_fallback(gray_image: np.ndarray, dilation_px=50) -> Tuple[np.ndarray, tuple]:
-    _, binary = cv2.threshold(gray_image, 240, 255, cv2.THRESH_BINARY_INV)
+    # The mask is coarse (and dilated by ~50px), so threshold/close/contour on
+    # a copy whose long side is ~FALLBACK_MAX_SIDE and scale the mask back up.
+    H, W = gray_image.shape[:2]
+    scale = max(1, max(H, W) // FALLBACK_MAX_SIDE)
+    if scale > 1:
+        small = cv2.resize(gray_image, (W // scale, H // scale), interpolation=cv2.INTER_AREA)
+        dilation_px = max(1, dilation_px // scale) if dilation_px > 0 else 0
+    else:
+        small = gray_image
+
+    _, binary = cv2.threshold(small, 240, 255, cv2.THRESH_BINARY_INV)
     kernel = np.ones((5, 5), np.uint8)
 
     if USE_CUDA:
@@ -209,26 +330,23 @@ def segment_building_opencv_fallback(gray_image: np.ndarray, dilation_px=50) ->
 
     contours, _ = cv2.findContours(closed, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
     
-    mask = np.zeros_like(gray_image)
-    if not contours: return mask, gray_image.shape[::-1]
+    if not contours: return np.zeros_like(gray_image), (W, H)
     
-    img_area = gray_image.shape[0] * gray_image.shape[1]
-    for cnt in contours:
-        area = cv2.contourArea(cnt)
-        if area > (img_area * 0.005) and area < (img_area * 0.95):
-            cv2.drawContours(mask, [cnt], -1, 255, -1)
+    mask = np.zeros_like(small)
+    img_area = small.shape[0] * small.shape[1]
+    areas = _poly_areas(contours)
+    keep_idx = np.nonzero((areas > img_area * 0.005) & (areas < img_area * 0.95))[0]
+    if len(keep_idx):
+        # Single fill call for all kept contours
+        cv2.drawContours(mask, [contours[i] for i in keep_idx], -1, 255, -1)
             
     if dilation_px > 0:
-        dil_kernel = np.ones((dilation_px, dilation_px), np.uint8)
-        if USE_CUDA:
-            gpu_mask = cv2.cuda_GpuMat()
-            gpu_mask.upload(mask)
-            dil_filter = cv2.cuda.createMorphologyFilter(cv2.MORPH_DILATE, cv2.CV_8U, dil_kernel)
-            mask = dil_filter.apply(gpu_mask).download()
-        else:
-            mask = cv2.dilate(mask, dil_kernel, iterations=1)
+        mask = dilate_square(mask, dilation_px)
+
+    if scale > 1:
+        mask = cv2.resize(mask, (W, H), interpolation=cv2.INTER_NEAREST)
         
-    return mask, (gray_image.shape[1], gray_image.shape[0])
+    return mask, (W, H)
 
 # ==========================================
 # UNIFIED INTERFACE
@@ -236,25 +354,16 @@ def segment_building_opencv_fallback(gray_image: np.ndarray, dilation_px=50) ->
 def generate_building_mask(image: np.ndarray, use_sam3=True, dilation_px=50) -> Tuple[np.ndarray, tuple]:
     # Use Roboflow (labeled as use_sam3 to keep API consistent)
     if use_sam3:
-        # Convert to RGB if needed for API
+        # Convert to RGB if needed for API (gray is only derived on fallback)
         if len(image.shape) == 2:
             rgb_image = cv2.cvtColor(image, cv2.COLOR_GRAY2RGB)
-            gray_image = image
         else:
             rgb_image = image
-            gray_image = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
             
         mask, _ = segment_building_automatic(rgb_image)
         if mask is not None:
             if dilation_px > 0:
-                dil_kernel = np.ones((dilation_px, dilation_px), np.uint8)
-                if USE_CUDA:
-                    gpu_mask = cv2.cuda_GpuMat()
-                    gpu_mask.upload(mask)
-                    dil_filter = cv2.cuda.createMorphologyFilter(cv2.MORPH_DILATE, cv2.CV_8U, dil_kernel)
-                    mask = dil_filter.apply(gpu_mask).download()
-                else:
-                    mask = cv2.dilate(mask, dil_kernel, iterations=1)
+                mask = dilate_square(mask, dilation_px)
             return mask, (mask.shape[1], mask.shape[0])
             
     # Fallback to OpenCV
@@ -1,30 +1,39 @@
 import ollama
 import json
 import re
-import io
+import hashlib
+from PIL import Image
+from pipeline.vlm_image import encode_vlm_jpeg
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+def _dumps(obj, sort_keys=False):
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_SORT_KEYS if sort_keys else 0).decode()
+    return json.dumps(obj, sort_keys=sort_keys)
 
 MODEL_NAME = "qwen3-vl:30b-a3b-instruct"
 
-def validate_step(image, candidate_data, phase_context):
-    """
-    Universal Validator for EIFS Takeoff.
-    image: PIL image or bytes
-    candidate_data: The JSON output from the phase being tested
-    phase_context: String describing what we are validating (e.g., 'Sheet Classification')
-    """
-    byte_arr = io.BytesIO()
-    if not isinstance(image, bytes):
-        image.save(byte_arr, format='PNG')
-        img_bytes = byte_arr.getvalue()
-    else:
-        img_bytes = image
+# The VLM resizes its input anyway, so artifacts are downscaled before the
+# (shared) JPEG encode.
+VALIDATOR_MAX_SIDE = 1536
 
-    prompt = f"""
+# Identical (image, context, candidate) audits are answered from memory.
+_RESULT_CACHE = {}
+RESULT_CACHE_MAX = 1024
+
+# Keep the model resident between artifacts so each audit skips the load.
+VALIDATOR_KEEP_ALIVE = "10m"
+
+# Fixed audit instructions go first as the system message, so every request
+# shares the same prompt prefix and Ollama can reuse its prefill; only the
+# context, candidate data and image vary per call.
+SYSTEM_PROMPT = """
     You are a Senior Estimation Auditor.
     
-    [AUDIT CONTEXT]: Validating {phase_context}
-    [CANDIDATE DATA]: {json.dumps(candidate_data)}
-    
     TASK: Inspect the provided image and the candidate data. Verify if the AI has hallucinated.
     
     CRITERIA:
@@ -33,21 +42,55 @@ def validate_step(image, candidate_data, phase_context):
     3. Hallucination Check: Did the AI mention things not present on this specific sheet?
     
     OUTPUT JSON FORMAT (STRICT):
-    {{
+    {
         "confidence_score": 0.0 to 1.0,
         "status": "VALIDATED" or "WARNING" or "REJECTED",
         "hallucination_detected": true/false,
         "critique": "Detailed explanation of visual discrepancies."
-    }}
+    }
+    """
+
+def encode_image(image):
+    if image.width > VALIDATOR_MAX_SIDE or image.height > VALIDATOR_MAX_SIDE:
+        ratio = VALIDATOR_MAX_SIDE / max(image.width, image.height)
+        image = image.resize((max(1, round(image.width * ratio)), max(1, round(image.height * ratio))), Image.LANCZOS, reducing_gap=2.0)
+    return encode_vlm_jpeg(image)
+
+def validate_step(image, candidate_data, phase_context):
+    """
+    Universal Validator for EIFS Takeoff.
+    image: PIL image or bytes
+    candidate_data: The JSON output from the phase being tested
+    phase_context: String describing what we are validating (e.g., 'Sheet Classification')
+    """
+    if not isinstance(image, bytes):
+        img_bytes = encode_image(image)
+    else:
+        img_bytes = image
+
+    cache_key = (hashlib.blake2b(img_bytes, digest_size=16).digest(), phase_context, _dumps(candidate_data, sort_keys=True))
+    if cache_key in _RESULT_CACHE: return dict(_RESULT_CACHE[cache_key])
+
+    prompt = f"""
+    [AUDIT CONTEXT]: Validating {phase_context}
+    [CANDIDATE DATA]: {_dumps(candidate_data)}
     """
     
     try:
         response = ollama.chat(
             model=MODEL_NAME, 
-            messages=[{'role': 'user', 'content': prompt, 'images': [img_bytes]}],
-            format='json'
+            messages=[
+                {'role': 'system', 'content': SYSTEM_PROMPT},
+                {'role': 'user', 'content': prompt, 'images': [img_bytes]},
+            ],
+            format='json',
+            keep_alive=VALIDATOR_KEEP_ALIVE,
         )
-        return json.loads(response['message']['content'])
+        content = response['message']['content']
+        result = orjson.loads(content) if orjson is not None else json.loads(content)
+        if len(_RESULT_CACHE) >= RESULT_CACHE_MAX: _RESULT_CACHE.clear()
+        _RESULT_CACHE[cache_key] = result
+        return dict(result)
     except Exception as e:
         return {
             "confidence_score": 0.0,
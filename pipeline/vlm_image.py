@@ -0,0 +1,32 @@
+import io
+
+
+# ============================================================
+# VLM IMAGE ENCODING — SHARED BY ALL PHASES
+# ============================================================
+# - JPEG for whole sheets and view tiles: the model downsamples them
+#   anyway, and JPEG encodes and uploads far faster than PNG
+# - PNG (deflate level 1) for line drawings and dense small text
+#   (schedules, type legends, dimension strings), where JPEG ringing
+#   smears thin strokes and fractions; level 1 is several times faster
+#   than PIL's default 6 for a modest size increase
+# ============================================================
+
+VLM_JPEG_QUALITY = 85
+VLM_PNG_LEVEL = 1
+
+
+def encode_vlm_jpeg(img):
+    """PIL image -> JPEG bytes for a VLM request."""
+    if img.mode not in ("RGB", "L"):
+        img = img.convert("RGB")
+    with io.BytesIO() as byte_arr:
+        img.save(byte_arr, format="JPEG", quality=VLM_JPEG_QUALITY, optimize=False)
+        return byte_arr.getvalue()
+
+
+def encode_vlm_png(img):
+    """PIL image -> lossless PNG bytes for a VLM request."""
+    with io.BytesIO() as byte_arr:
+        img.save(byte_arr, format="PNG", compress_level=VLM_PNG_LEVEL)
+        return byte_arr.getvalue()
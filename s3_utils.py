@@ -4,15 +4,93 @@ Handles file uploads to S3 bucket with error handling
 """
 
 import os
+import time
+import random
+import hashlib
+import logging
+import threading
 import boto3
+from boto3.exceptions import S3UploadFailedError
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
 from botocore.exceptions import ClientError, NoCredentialsError
 from typing import Optional, Dict
 from concurrent.futures import ThreadPoolExecutor, as_completed
 
+logger = logging.getLogger(__name__)
+
+# Concurrent uploads in upload_pipeline_outputs. Uploads are network-bound,
+# so this can exceed the core count; the shared client's connection pool
+# covers every worker's parts so none wait on a connection.
+S3_UPLOAD_WORKERS = 8
+
+# Files above the threshold (debug PDFs) upload as parallel parts. Outputs are
+# rarely more than a few hundred MB, so 16 MiB parts keep several parts in
+# flight; per-file concurrency stays modest because files upload in parallel too.
+S3_PART_CONCURRENCY = 4
+_TRANSFER_CONFIG = TransferConfig(
+    multipart_threshold=16 * 1024 * 1024,
+    multipart_chunksize=16 * 1024 * 1024,
+    max_concurrency=S3_PART_CONCURRENCY,
+    use_threads=True,
+)
+
+# Files below this go up as a single put_object; s3transfer's thread/future
+# setup is a large share of the latency for a few-KB JSON or log file
+S3_SMALL_PUT_BYTES = 5 * 1024 * 1024
+
+# Files at least this large are hashed and skipped if S3 already has the
+# same bytes under the key (one HEAD instead of the whole PUT)
+S3_DEDUP_MIN_BYTES = 16 * 1024 * 1024
+
+# S3_ACCELERATE=1 routes S3 traffic through Transfer Acceleration edge
+# locations (opt-in; the bucket must have acceleration enabled). Read on first
+# use, see _env_flag.
+
+# Whole-upload attempts on throttling / 5xx, on top of botocore's own retries
+S3_UPLOAD_ATTEMPTS = 3
+
+# S3_VERIFY_UPLOAD=1 re-checks uploaded objects with one LIST per run prefix
+# (off by default; read on first use, see _env_flag)
+
+
+# One client per process: building a boto3 client loads the service model and
+# resolves credentials (tens of ms), and botocore clients are thread-safe.
+_S3_CLIENT = None
+_S3_CLIENT_LOCK = threading.Lock()
+
+# Bucket existence and region never change within a process, so each bucket
+# is probed once instead of on every upload.
+_BUCKET_VERIFIED = set()
+_BUCKET_REGION_CACHE = {}
+_BUCKET_CACHE_LOCK = threading.Lock()
+
+# S3_BUCKET_NAME, read on first use rather than at import: app.py imports this
+# module before load_dotenv() runs.
+_DEFAULT_BUCKET = None
+
+
+def get_default_bucket() -> Optional[str]:
+    """Return S3_BUCKET_NAME, looked up once it has been set"""
+    global _DEFAULT_BUCKET
+    if _DEFAULT_BUCKET is None:
+        _DEFAULT_BUCKET = os.getenv("S3_BUCKET_NAME") or None
+    return _DEFAULT_BUCKET
+
+
+# Opt-in "1"/"0" settings, memoised on first use for the same reason
+_ENV_FLAGS = {}
+
+
+def _env_flag(name: str) -> bool:
+    if name not in _ENV_FLAGS:
+        _ENV_FLAGS[name] = os.getenv(name, "0") == "1"
+    return _ENV_FLAGS[name]
+
 
 def get_s3_client():
     """
-    Initialize and return S3 client using IAM role from EC2 instance
+    Return the shared S3 client, creating it on first use (IAM role from EC2 instance)
     
     When running on EC2 with an IAM role, boto3 automatically retrieves:
     - Credentials from the instance metadata service
@@ -21,17 +99,30 @@ def get_s3_client():
     Returns:
         boto3.client: S3 client instance
     """
-    # boto3 will automatically use:
-    # 1. Credentials from EC2 instance IAM role
-    # 2. Region from EC2 instance metadata
-    # No need to pass any credentials or region explicitly
-    return boto3.client('s3')
+    global _S3_CLIENT
+    if _S3_CLIENT is None:
+        with _S3_CLIENT_LOCK:
+            if _S3_CLIENT is None:
+                # boto3 will automatically use:
+                # 1. Credentials from EC2 instance IAM role
+                # 2. Region from EC2 instance metadata
+                # No need to pass any credentials or region explicitly
+                _S3_CLIENT = boto3.client('s3', config=Config(
+                    max_pool_connections=max(16, S3_UPLOAD_WORKERS * S3_PART_CONCURRENCY),
+                    retries={'max_attempts': 5, 'mode': 'adaptive'},
+                    # Accelerate needs virtual-host addressing; otherwise keep
+                    # botocore's default (dotted bucket names use path style)
+                    s3=({'use_accelerate_endpoint': True, 'addressing_style': 'virtual'}
+                        if _env_flag("S3_ACCELERATE") else None),
+                ))
+    return _S3_CLIENT
 
 
 def upload_file_to_s3(
     local_file_path: str,
     s3_key: str,
-    bucket_name: Optional[str] = None
+    bucket_name: Optional[str] = None,
+    s3_client=None
 ) -> Optional[str]:
     """
     Upload a file to S3 bucket
@@ -40,82 +131,114 @@ def upload_file_to_s3(
         local_file_path: Path to local file to upload
         s3_key: S3 object key (path in bucket)
         bucket_name: S3 bucket name (defaults to env variable)
+        s3_client: Client to use (defaults to the shared client)
     
     Returns:
         str: S3 URL if successful, None if failed
     """
     if bucket_name is None:
-        bucket_name = os.getenv("S3_BUCKET_NAME")
+        bucket_name = get_default_bucket()
     
     if not bucket_name:
-        print("⚠️ S3_BUCKET_NAME not configured, skipping S3 upload")
+        logger.warning("⚠️ S3_BUCKET_NAME not configured, skipping S3 upload")
         return None
     
-    if not os.path.exists(local_file_path):
-        print(f"⚠️ File not found: {local_file_path}")
+    # One stat gives both the existence check and the size used below
+    try:
+        file_size = os.stat(local_file_path).st_size
+    except OSError:
+        logger.warning(f"⚠️ File not found: {local_file_path}")
         return None
     
     try:
-        s3_client = get_s3_client()
+        if s3_client is None:
+            s3_client = get_s3_client()
         
-        # Validate bucket exists and is accessible before upload
+        # Validate bucket exists and is accessible before upload (once per bucket)
         try:
-            s3_client.head_bucket(Bucket=bucket_name)
+            if bucket_name not in _BUCKET_VERIFIED:
+                head = s3_client.head_bucket(Bucket=bucket_name)
+                # S3 reports the bucket's region on HeadBucket, which saves the
+                # separate GetBucketLocation call (and its IAM permission)
+                region = head.get('ResponseMetadata', {}).get('HTTPHeaders', {}).get('x-amz-bucket-region')
+                with _BUCKET_CACHE_LOCK:
+                    _BUCKET_VERIFIED.add(bucket_name)
+                    if region:
+                        _BUCKET_REGION_CACHE.setdefault(bucket_name, region)
         except ClientError as e:
             error_code = e.response.get('Error', {}).get('Code', '')
             if error_code == '404' or error_code == 'NoSuchBucket':
-                print(f"❌ S3 bucket '{bucket_name}' does not exist")
+                logger.error(f"❌ S3 bucket '{bucket_name}' does not exist")
                 return None
             elif error_code == '403' or error_code == 'Forbidden':
-                print(f"❌ Access denied to S3 bucket '{bucket_name}'. Check IAM permissions.")
+                logger.error(f"❌ Access denied to S3 bucket '{bucket_name}'. Check IAM permissions.")
                 return None
             else:
-                print(f"⚠️ Cannot access bucket '{bucket_name}': {e}")
+                logger.warning(f"⚠️ Cannot access bucket '{bucket_name}': {e}")
                 return None
         
         # Determine content type based on file extension
         content_type = get_content_type(local_file_path)
         
-        # Upload file with metadata
-        try:
-            s3_client.upload_file(
-                local_file_path,
-                bucket_name,
-                s3_key,
-                ExtraArgs={'ContentType': content_type} if content_type else {}
-            )
-        except ClientError as e:
-            error_code = e.response.get('Error', {}).get('Code', '')
-            if error_code == '403' or error_code == 'AccessDenied':
-                print(f"❌ Access denied: Cannot upload to s3://{bucket_name}/{s3_key}")
-                print("   Check IAM role has s3:PutObject permission")
-                return None
-            else:
-                print(f"❌ Upload failed: {e}")
-                return None
+        extra_args = {'ContentType': content_type} if content_type else {}
         
-        # Verify upload was successful by checking object existence
-        try:
-            s3_client.head_object(Bucket=bucket_name, Key=s3_key)
-        except ClientError as e:
-            error_code = e.response.get('Error', {}).get('Code', '')
-            if error_code == '404':
-                print(f"⚠️ Upload verification failed: File not found in S3 after upload")
-                return None
-            else:
-                print(f"⚠️ Upload verification failed: {e}")
-                # Upload might have succeeded despite verification failure
-                # Continue to generate URL
+        # Large outputs carry a content hash; a rerun that produces the same
+        # bytes under the same key skips the PUT. Small files are cheaper to
+        # re-send than to HEAD first.
+        unchanged = False
+        if file_size >= S3_DEDUP_MIN_BYTES:
+            digest = _content_fingerprint(local_file_path)
+            extra_args['Metadata'] = {'contenthash': digest}
+            unchanged = _remote_matches(s3_client, bucket_name, s3_key, digest)
+            if unchanged:
+                logger.info(f"⏭️  Unchanged in S3, skipped upload: {s3_key}")
+        
+        if not unchanged:
+            # Upload file with metadata
+            def _send():
+                if file_size < S3_SMALL_PUT_BYTES:
+                    # JSON/log/Excel outputs: one PutObject, no transfer manager
+                    with open(local_file_path, 'rb') as f:
+                        s3_client.put_object(Bucket=bucket_name, Key=s3_key, Body=f, **extra_args)
+                else:
+                    s3_client.upload_file(
+                        local_file_path,
+                        bucket_name,
+                        s3_key,
+                        ExtraArgs=extra_args,
+                        Config=_TRANSFER_CONFIG
+                    )
+            
+            try:
+                _with_backoff(_send, s3_key)
+            except ClientError as e:
+                error_code = e.response.get('Error', {}).get('Code', '')
+                if error_code == '403' or error_code == 'AccessDenied':
+                    logger.error(f"❌ Access denied: Cannot upload to s3://{bucket_name}/{s3_key}")
+                    logger.error("   Check IAM role has s3:PutObject permission")
+                    return None
+                else:
+                    logger.error(f"❌ Upload failed: {e}")
+                    return None
+        
+        if _env_flag("S3_ACCELERATE"):
+            # Accelerate URLs are region-less, so no location lookup is needed
+            logger.info(f"✅ Uploaded to S3: {s3_key}")
+            return f"https://{bucket_name}.s3-accelerate.amazonaws.com/{s3_key}"
         
         # Generate S3 URL by automatically detecting the bucket's region
         # boto3 will retrieve the region from the bucket's location
         try:
-            bucket_location = s3_client.get_bucket_location(Bucket=bucket_name)
-            region = bucket_location.get('LocationConstraint')
-            
-            # Handle special case: eu-north-1 returns None
+            region = _BUCKET_REGION_CACHE.get(bucket_name)
             if region is None:
-                region = 'eu-north-1'
+                bucket_location = s3_client.get_bucket_location(Bucket=bucket_name)
+                region = bucket_location.get('LocationConstraint')
+                
+                # Handle special case: eu-north-1 returns None
+                if region is None:
+                    region = 'eu-north-1'
+                with _BUCKET_CACHE_LOCK:
+                    _BUCKET_REGION_CACHE[bucket_name] = region
             
             # Generate region-specific S3 URL (permanent)
             s3_url = f"https://{bucket_name}.s3.{region}.amazonaws.com/{s3_key}"
@@ -126,35 +249,99 @@ def upload_file_to_s3(
             if error_code == 'AccessDenied':
                 # Use default region (user's region) as fallback
                 region = 'eu-north-1'
+                with _BUCKET_CACHE_LOCK:
+                    _BUCKET_REGION_CACHE[bucket_name] = region
                 s3_url = f"https://{bucket_name}.s3.{region}.amazonaws.com/{s3_key}"
                 # Only log once to avoid spam
                 if not hasattr(upload_file_to_s3, '_logged_region_warning'):
-                    print(f"ℹ️  Note: s3:GetBucketLocation permission not available, using default region: {region}")
+                    logger.info(f"ℹ️  Note: s3:GetBucketLocation permission not available, using default region: {region}")
                     upload_file_to_s3._logged_region_warning = True
             else:
                 # Fallback to region-agnostic URL for other errors
                 s3_url = f"https://{bucket_name}.s3.amazonaws.com/{s3_key}"
-                print(f"⚠️ Could not detect bucket region: {error_code}")
+                logger.warning(f"⚠️ Could not detect bucket region: {error_code}")
         
         
         # Return just the permanent URL string
-        print(f"✅ Uploaded to S3: {s3_key}")
+        logger.info(f"✅ Uploaded to S3: {s3_key}")
         return s3_url
         
     except NoCredentialsError:
-        print("⚠️ AWS credentials not found, skipping S3 upload")
-        print("   Ensure EC2 instance has an IAM role attached")
+        logger.warning("⚠️ AWS credentials not found, skipping S3 upload")
+        logger.warning("   Ensure EC2 instance has an IAM role attached")
         return None
     except ClientError as e:
         error_code = e.response.get('Error', {}).get('Code', '')
         error_message = e.response.get('Error', {}).get('Message', str(e))
-        print(f"⚠️ S3 upload failed [{error_code}]: {error_message}")
+        logger.warning(f"⚠️ S3 upload failed [{error_code}]: {error_message}")
         return None
     except Exception as e:
-        print(f"⚠️ Unexpected error during S3 upload: {e}")
+        logger.warning(f"⚠️ Unexpected error during S3 upload: {e}")
         return None
 
 
+_RETRYABLE_CODES = {'SlowDown', 'RequestTimeout', 'RequestTimeTooSkewed', 'InternalError', 'ServiceUnavailable'}
+
+
+def _is_retryable(exc: Exception) -> bool:
+    """Throttling / transient server errors that are worth another attempt"""
+    if isinstance(exc, S3UploadFailedError):
+        # boto3 raises this while handling the underlying ClientError
+        exc = exc.__cause__ or exc.__context__
+    if isinstance(exc, ClientError):
+        error = exc.response.get('Error', {})
+        status = exc.response.get('ResponseMetadata', {}).get('HTTPStatusCode', 0)
+        return error.get('Code', '') in _RETRYABLE_CODES or status >= 500
+    return False
+
+
+def _with_backoff(fn, s3_key: str):
+    """
+    Run fn, retrying transient S3 failures with jittered exponential backoff.
+    botocore already retries each request; this covers a whole upload that
+    still failed, e.g. a multipart upload throttled mid-way.
+    """
+    for attempt in range(S3_UPLOAD_ATTEMPTS):
+        try:
+            return fn()
+        except (ClientError, S3UploadFailedError) as e:
+            if attempt == S3_UPLOAD_ATTEMPTS - 1 or not _is_retryable(e):
+                raise
+            delay = (2 ** attempt) + random.uniform(0, 0.5)
+            logger.warning(f"⚠️ Transient S3 error for {s3_key}, retrying in {delay:.1f}s: {e}")
+            time.sleep(delay)
+
+
+def _content_fingerprint(path: str) -> str:
+    """SHA-256 of a local file, read in 1 MiB blocks"""
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _remote_matches(s3_client, bucket_name: str, s3_key: str, digest: str) -> bool:
+    """True if the object already in S3 carries the same content hash"""
+    try:
+        head = s3_client.head_object(Bucket=bucket_name, Key=s3_key)
+    except ClientError:
+        return False
+    return head.get('Metadata', {}).get('contenthash') == digest
+
+
+_CONTENT_TYPES = {
+    '.pdf': 'application/pdf',
+    '.json': 'application/json',
+    '.xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    '.txt': 'text/plain',
+    '.log': 'text/plain',
+    '.png': 'image/png',
+    '.jpg': 'image/jpeg',
+    '.jpeg': 'image/jpeg',
+}
+
+
 def get_content_type(file_path: str) -> Optional[str]:
     """
     Determine content type based on file extension
@@ -165,40 +352,28 @@ def get_content_type(file_path: str) -> Optional[str]:
     Returns:
         str: MIME type or None
     """
-    extension = os.path.splitext(file_path)[1].lower()
-    
-    content_types = {
-        '.pdf': 'application/pdf',
-        '.json': 'application/json',
-        '.xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-        '.txt': 'text/plain',
-        '.log': 'text/plain',
-        '.png': 'image/png',
-        '.jpg': 'image/jpeg',
-        '.jpeg': 'image/jpeg',
-    }
-    
-    return content_types.get(extension)
+    return _CONTENT_TYPES.get(os.path.splitext(file_path)[1].lower())
 
 
 
-def upload_pipeline_outputs(run_id: str, files_dict: dict, cleanup_local: bool = False) -> dict:
+# Long-lived upload workers so callers can start uploads as soon as each file
+# is final and collect the results later (see submit_pipeline_outputs).
+_UPLOAD_POOL = ThreadPoolExecutor(max_workers=S3_UPLOAD_WORKERS, thread_name_prefix="s3-upload")
+
+
+def submit_pipeline_outputs(run_id: str, files_dict: dict) -> dict:
     """
-    Upload multiple pipeline output files to S3 with presigned URLs (in parallel)
+    Start uploading pipeline output files to S3 in the background
     
     Args:
         run_id: Pipeline run ID
         files_dict: Dictionary with file types as keys and local paths as values
                    Example: {'excel': '/path/to/file.xlsx', 'json': '/path/to/file.json'}
-        cleanup_local: If True, delete local files after successful S3 upload
     
     Returns:
-        dict: Dictionary with file types as keys and upload info (URLs, presigned URLs) as values
+        dict: File type -> (local_path, s3_key, Future) for collect_pipeline_outputs
     """
-    s3_data = {}
-    
-    # Prepare upload tasks
-    upload_tasks = []
+    pending = {}
     for file_type, local_path in files_dict.items():
         if local_path and os.path.exists(local_path):
             filename = os.path.basename(local_path)
@@ -207,43 +382,93 @@ def upload_pipeline_outputs(run_id: str, files_dict: dict, cleanup_local: bool =
                 s3_key = f"pipeline-outputs/{run_id}/pdf/{filename}"
             else:
                 s3_key = f"pipeline-outputs/{run_id}/{filename}"
-            upload_tasks.append((file_type, local_path, s3_key))
+            pending[file_type] = (local_path, s3_key, _UPLOAD_POOL.submit(upload_file_to_s3, local_path, s3_key))
     
-    if not upload_tasks:
-        return s3_data
+    if pending:
+        logger.info(f"📤 Uploading {len(pending)} files to S3 in parallel...")
+    return pending
+
+
+def _list_keys(s3_keys: set) -> Optional[set]:
+    """
+    List the keys under the common prefix of s3_keys (one paginated LIST
+    instead of a HEAD per object). Returns None if the listing failed.
+    """
+    bucket_name = get_default_bucket()
+    prefix = os.path.commonprefix(list(s3_keys))
+    prefix = prefix[:prefix.rfind("/") + 1]
+    present = set()
+    try:
+        paginator = get_s3_client().get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=bucket_name, Prefix=prefix):
+            present.update(obj["Key"] for obj in page.get("Contents", ()))
+    except (ClientError, NoCredentialsError) as e:
+        logger.warning(f"⚠️ Upload verification skipped: {e}")
+        return None
+    return present
+
+
+def collect_pipeline_outputs(pending: dict, cleanup_local: bool = False) -> dict:
+    """
+    Wait for uploads started by submit_pipeline_outputs
     
-    # Upload files in parallel using ThreadPoolExecutor
-    print(f"📤 Uploading {len(upload_tasks)} files to S3 in parallel...")
+    Args:
+        pending: Result(s) of submit_pipeline_outputs (merge dicts to collect several)
+        cleanup_local: If True, delete local files after successful S3 upload
     
-    def upload_single_file(task):
-        file_type, local_path, s3_key = task
-        result = upload_file_to_s3(local_path, s3_key)
-        return file_type, local_path, result
+    Returns:
+        dict: Dictionary with file types as keys and S3 URLs as values
+    """
+    s3_data = {}
+    uploaded = {}
+    future_to_task = {future: (file_type, local_path, s3_key)
+                      for file_type, (local_path, s3_key, future) in pending.items()}
     
-    with ThreadPoolExecutor(max_workers=min(4, len(upload_tasks))) as executor:
-        # Submit all upload tasks
-        future_to_task = {executor.submit(upload_single_file, task): task for task in upload_tasks}
-        
-        # Process results as they complete
-        for future in as_completed(future_to_task):
+    # Process results as they complete
+    for future in as_completed(future_to_task):
+        file_type, local_path, s3_key = future_to_task[future]
+        try:
+            upload_result = future.result()
+            
+            if upload_result:
+                s3_data[file_type] = upload_result
+                uploaded[file_type] = (local_path, s3_key)
+        except Exception as e:
+            logger.error(f"❌ Upload failed for {file_type}: {e}")
+    
+    if uploaded and _env_flag("S3_VERIFY_UPLOAD"):
+        present = _list_keys({s3_key for _, s3_key in uploaded.values()})
+        if present is not None:
+            for file_type, (_, s3_key) in list(uploaded.items()):
+                if s3_key not in present:
+                    logger.warning(f"⚠️ Upload verification failed: {s3_key} not found in S3 after upload")
+                    del s3_data[file_type]
+                    del uploaded[file_type]
+    
+    # Optional: Clean up local files after successful upload
+    if cleanup_local:
+        for local_path, _ in uploaded.values():
             try:
-                file_type, local_path, upload_result = future.result()
-                
-                if upload_result:
-                    s3_data[file_type] = upload_result
-                    
-                    # Optional: Clean up local file after successful upload
-                    if cleanup_local:
-                        try:
-                            os.remove(local_path)
-                            print(f"🗑️  Deleted local file: {local_path}")
-                        except Exception as e:
-                            print(f"⚠️ Could not delete local file {local_path}: {e}")
+                os.remove(local_path)
+                logger.info(f"🗑️  Deleted local file: {local_path}")
             except Exception as e:
-                task = future_to_task[future]
-                print(f"❌ Upload failed for {task[0]}: {e}")
+                logger.warning(f"⚠️ Could not delete local file {local_path}: {e}")
     
-    print(f"✅ Completed {len(s3_data)}/{len(upload_tasks)} uploads")
+    if pending:
+        logger.info(f"✅ Completed {len(s3_data)}/{len(pending)} uploads")
     return s3_data
 
 
+def upload_pipeline_outputs(run_id: str, files_dict: dict, cleanup_local: bool = False) -> dict:
+    """
+    Upload multiple pipeline output files to S3 (in parallel) and wait for them
+    
+    Args:
+        run_id: Pipeline run ID
+        files_dict: Dictionary with file types as keys and local paths as values
+        cleanup_local: If True, delete local files after successful S3 upload
+    
+    Returns:
+        dict: Dictionary with file types as keys and S3 URLs as values
+    """
+    return collect_pipeline_outputs(submit_pipeline_outputs(run_id, files_dict), cleanup_local)